@@ -1,535 +1,275 @@
 import streamlit as st
-import pandas as pd
-import geopandas as gpd 
-from shapely.geometry import Point 
 import datetime
-import io 
-import numpy as np
-import zipfile 
-
-st.title("RideAmigos Report Processing")
-
-startDate = st.date_input("Select the first date of the reporting period", datetime.date.today())
-endDate = st.date_input("Select the last date of the reporting period", datetime.date.today())
-
-
-user_file = st.file_uploader("Choose the Users Report", type ="xlsx")
-if user_file is not None:
-    df_users=pd.read_excel(user_file)
-    st.write("File uploaded!")
-
-    # Get rid of junk/test records in user file
-    df_users.drop(df_users[df_users["Networks"].isin(["RideAmigos Employees", "RideAmigos Test Network"])].index, inplace=True)
-    df_users.drop(df_users[df_users["Email"].fillna("").str.contains("@rideamigos.com|@example.com|@test.com", regex=True)].index, inplace=True)
-    df_users.drop(df_users[df_users["Email"].isin([
-        "appreview2055@icloud.com", 
-        "webteam@odonnellco.com", 
-        "maureen.contestabile@odonnellco.com", 
-        "kathryn.hagerman@gmail.com", 
-        "bendalton+aminew@gmail.com", 
-        "chancemagno@gmail.com", 
-        "acuadrado@atlantaregional.com", 
-        "acuadrado@gacommuteoptions.com", 
-        "support@mygacommuteoptions.com", 
-        "support@gacommuteoptions.com"
-    ])].index, inplace=True)
-    df_users.drop(df_users[df_users["Employer Name"].isin([
-        "RideAmigos",
-        "Test Employer"
-    ])].index, inplace=True)
-
-    st.subheader("Users Data Preview")
-    st.write(df_users.head())
-else: 
-   st.write("Waiting for upload.")
-
-trip_file = st.file_uploader("Choose the Trips Report", type ="xlsx")
-if trip_file is not None:
-    df_trips=pd.read_excel(trip_file)
-    st.write("File uploaded!")
-
-    # Get rid of junk/test records from trips file:
-
-    df_trips.drop(df_trips[df_trips["Networks"].isin(["RideAmigos Employees", "RideAmigos Test Network"])].index, inplace=True)
-    df_trips.drop(df_trips[df_trips["User Email"].fillna("").str.contains("@rideamigos.com|@example.com|@test.com", regex=True)].index, inplace=True)
-    df_trips.drop(df_trips[df_trips["User Email"].isin([
-        "appreview2055@icloud.com", 
-        "webteam@odonnellco.com", 
-        "maureen.contestabile@odonnellco.com", 
-        "kathryn.hagerman@gmail.com", 
-        "bendalton+aminew@gmail.com", 
-        "chancemagno@gmail.com", 
-        "acuadrado@atlantaregional.com", 
-        "acuadrado@gacommuteoptions.com", 
-        "support@mygacommuteoptions.com", 
-        "support@gacommuteoptions.com"
-    ])].index, inplace=True)
-    df_trips.drop(df_trips[df_trips["User Name"].isin(["Network Log"])].index, inplace=True)
-
-    st.subheader("Trips Data Preview")
-    st.write(df_trips.head())
-else: 
-   st.write("Waiting for upload.")
-
-
-if trip_file is not None and user_file is not None: 
-    st.subheader("Process Records")
-    st.write(f"Click the button below to process records for the period {startDate} through {endDate}.")
-    if st.button("PROCESS RECORDS"):
-        
-        st.write("Working: may take a few minutes to process...")
-
-        # The User ID is called "_id" in the Users table but "User ID" in the trip log, so we adjust the name in the users dataframe to match for joining purposes.
-        df_users = df_users.rename(columns={'_id': 'User ID'})
-
-        # Split coordinates into latitude and longitude
-        df_users[['LonHome', 'LatHome']] = df_users['Home Location Coords'].str.split(',', expand=True).astype(float)
-        df_users[['LonWork', 'LatWork']] = df_users['Work Location Coords'].str.split(',', expand=True).astype(float)
-
-        # Convert to GeoDataFrame
-        df_users['geometry_work'] = df_users.apply(lambda row: Point(row['LonWork'], row['LatWork']), axis=1)
-        df_users['geometry_home'] = df_users.apply(lambda row: Point(row['LonHome'], row['LatHome']), axis=1)
-
-        gdf_work = gpd.GeoDataFrame(df_users, geometry='geometry_work', crs="EPSG:4326")
-        gdf_home = gpd.GeoDataFrame(df_users, geometry='geometry_home', crs="EPSG:4326")
-
-        # Load ESO shapefile
-        eso_gdf = gpd.read_file("data/Employer_Service_Organizations.shp")
-        eso_gdf.rename(columns={'NAME': 'ESO'}, inplace=True)
-
-        # Load Counties shapefile
-        counties_gdf = gpd.read_file("data/tl_2020_13_county20.shp")
-
-        # Load ZCTA shapefile
-        zip_gdf = gpd.read_file("data/tl_2020_13_zcta520.shp")
-
-        # Ensure all dataframes are in the coordinaate reference system
-        eso_gdf = eso_gdf.to_crs(gdf_work.crs)
-        zip_gdf = zip_gdf.to_crs(gdf_work.crs)
-        counties_gdf = counties_gdf.to_crs(gdf_work.crs)
-
-        # Perform spatial joins
-
-        # Joins to ESO: (Note: we're determining Home ESO in order to check whether a home address is within region)
-        gdf_work = gpd.sjoin(gdf_work, eso_gdf, how="left", predicate="within")
-        gdf_work.drop(columns=['index_right'], inplace=True)
-
-        gdf_home = gdf_home.reset_index(drop=True)
-        eso_gdf = eso_gdf.reset_index(drop=True)
-
-        gdf_home = gpd.sjoin(gdf_home, eso_gdf, how="left", predicate="within")
-        gdf_home.drop(columns=['index_right'], inplace=True)
-        gdf_home.rename(columns={'ESO': 'Home ESO'}, inplace=True)
-
-        # Joins to ZCTA:
-        gdf_home = gpd.sjoin(gdf_home, zip_gdf, how="left", predicate="within")
-        gdf_home.rename(columns={'GEOID20': 'Home ZIP'}, inplace=True)
-        gdf_home.drop(columns=['index_right'], inplace=True)
-
-        gdf_work = gpd.sjoin(gdf_work, zip_gdf, how="left", predicate="within")
-        gdf_work.rename(columns={'GEOID20': 'Work ZIP'}, inplace=True)
-        gdf_work.drop(columns=['index_right'], inplace=True)
-
-        # Joins to Counties:
-        gdf_work = gpd.sjoin(gdf_work, counties_gdf, how="left", predicate="within")
-        gdf_work.rename(columns={'NAME20': 'Work County Name', 'GEOID20': 'Work County FIPS'}, inplace=True)
-
-        gdf_home = gpd.sjoin(gdf_home, counties_gdf, how="left", predicate="within")
-        gdf_home.rename(columns={'NAME20': 'Home County Name', 'GEOID20': 'Home County FIPS'}, inplace=True)
-
-        # Merge results of spatial joins into original users dataframe
-        df_users = df_users.merge(gdf_work[['User ID', 'ESO', 'Work ZIP', 'Work County Name','Work County FIPS']], on="User ID", how="left")
-        df_users = df_users.merge(gdf_home[['User ID', 'Home ESO', 'Home ZIP','Home County Name','Home County FIPS']], on="User ID", how="left")
-
-
-        # Handle missing data: If lat/lon exists but ESO spatial join is empty, code as "Out of Region"; if lat/lon null, code as "Unknown"
-        # Then we'll use the ESO results to determine unknown/out of region for the remaining fields
-
-        df_users['ESO'] = df_users.apply(lambda row: "Out of Region" if pd.isna(row['ESO']) and pd.notna(row['LonWork']) and pd.notna(row['LatWork']) 
-                                        else ("Unknown" if pd.isna(row['LonWork']) or pd.isna(row['LatWork']) else row['ESO']), axis=1)
-
-        df_users['Home ESO'] = df_users.apply(lambda row: "Out of Region" if pd.isna(row['Home ESO']) and pd.notna(row['LonHome']) and pd.notna(row['LatHome']) 
-                                        else ("Unknown" if pd.isna(row['LonHome']) or pd.isna(row['LatHome']) else row['Home ESO']), axis=1)
-
-        df_users.loc[df_users['ESO'] == "Unknown", 'Work ZIP'] = "Unknown"
-        df_users.loc[df_users['ESO'] == "Out of Region", 'Work ZIP'] = "Out of Region"
-
-        df_users.loc[df_users['ESO'] == "Unknown", 'Work County Name'] = "Unknown"
-        df_users.loc[df_users['ESO'] == "Out of Region", 'Work County Name'] = "Out of Region"
-
-        df_users.loc[df_users['ESO'] == "Unknown", 'Work County FIPS'] = "Unknown"
-        df_users.loc[df_users['ESO'] == "Out of Region", 'Work County FIPS'] = "Out of Region"
-
-        df_users.loc[df_users['Home ESO'] == "Unknown", 'Home ZIP'] = "Unknown"
-        df_users.loc[df_users['Home ESO'] == "Out of Region", 'Home ZIP'] = "Out of Region"
-
-        df_users.loc[df_users['Home ESO'] == "Unknown", 'Home County Name'] = "Unknown"
-        df_users.loc[df_users['Home ESO'] == "Out of Region", 'Home County Name'] = "Out of Region"
-
-        df_users.loc[df_users['Home ESO'] == "Unknown", 'Home County FIPS'] = "Unknown"
-        df_users.loc[df_users['Home ESO'] == "Out of Region", 'Home County FIPS'] = "Out of Region"
-
-
-        # The GDOT report needs certain records marked as "GCO/State Fed". 
-        # Add a new field containing the same value as 'ESO' if 'State/Fed' is blank, and "GCO State/Fed" if 'State/Fed' contains any value.
-        df_users['ESO Adjust State/Fed'] = df_users['ESO']
-        df_users.loc[df_users['State/Fed'].notna() & (df_users['State/Fed'] != ''), 'ESO Adjust State/Fed'] = "GCO State/Fed"
-
-        # Create dummy variable to count New Users. First create datetime, then convert to date, then make comparison to date range previously specified by the user.
-        # df_users['Registration Date'] = pd.to_datetime(df_users['Created'], format='%m/%d/%Y')
-        df_users['Registration Date'] = pd.to_datetime(df_users['Created'], format='%m/%d/%y %I:%M %p')
-        df_users['Registration Date'] = df_users['Registration Date'].dt.date
-        df_users['New Users'] = ((df_users['Registration Date'] >= startDate) & (df_users['Registration Date'] <= endDate)).astype(int)
-
-        # We can save intermediate results for diagnostic purposes if needed:
-        # df_users.to_excel("Spatial Join Test.xlsx", index=False)
-
-
-
-        # Next we work on the TRIPS dataframe
-
-        # Add fields present in the Users Dataframe to the Trips dataframe: "ESO", "Home ZIP", and "ESO Adjust State/Fed".
-        df_trips = df_trips.merge(df_users[['User ID', 'ESO', 'Home ZIP', 'ESO Adjust State/Fed']], on='User ID', how='left')
-
-        # We can save intermediate results for diagnostic purposes if needed:
-        #df_trips.to_excel("Merge Test.xlsx", index=False)
-
-        # Rename column names to match desired output
-        df_trips.rename(columns={'Mode': 'Method', 'CO2 Savings (grams)': 'CO2', 'Dollars Savings': 'Dollars', 'Vehicle Miles Reduced': 'VMR'}, inplace=True)
-
-        # Change the Method values to match desired output, e.g., "cww" in raw data should come out "CWW"
-        df_trips['Method'] = df_trips['Method'].replace({'bike': 'Bike', 'carpool': 'Carpool', 'cww': 'CWW', 'drive':'Drive', 'scooter': 'Scooter', 'telework': 'Telework', 'transit': 'Transit', 'vanpool': 'Vanpool', 'walk': 'Walk'})
-
-        # Keep only relevant columns and reorder
-        keep_columns = ['User ID', 'ESO', 'ESO Adjust State/Fed', 'Home ZIP', 'Method', 'Trips', 'Miles', 'VMR','CO2','Dollars']
-        df_trips = df_trips[keep_columns]
-
-        # We can save intermediate results for diagnostic purposes if needed:
-        # df_trips.to_excel("DF Trips Test.xlsx", index=False)
-
-        # Add a field called "Logs"-- summing this up will eventually give us trips logged x Method
-        df_trips['Logs'] = 1
-
-        # We can save intermediate results for diagnostic purposes if needed:
-        # df_trips.to_excel("Merge Test.xlsx", index=False)
-
-        # Collapse the trips dataframe to df_individual and df_individual_adjusted (ESO adjusted for State/Fed), each with with one record per person
-
-        df_individual = df_trips.groupby(['User ID', 'Method', 'ESO', 'Home ZIP'], as_index=False).agg({'Trips': 'sum', 'Miles': 'sum', 'VMR': 'sum', 'CO2': 'sum', 'Dollars': 'sum'})
-
-        df_individual_adjusted = df_trips.groupby(['User ID', 'Method', 'ESO Adjust State/Fed', 'Home ZIP'], as_index=False).agg({'Trips': 'sum', 'Miles': 'sum', 'VMR': 'sum', 'CO2': 'sum', 'Dollars': 'sum'})
-
-        # Save for diagnostics
-        # df_individual_adjusted.to_excel("DF Individual Test.xlsx", index=False)
-
-
-        # Now we'll count loggers and clean loggers (used in GDOT report, but may be useful elsewhere)
-
-        # Take a slice of the individual DF to work on separately 
-        df_loggers = df_individual_adjusted[['User ID','Method']].copy()
-
-        # Logger always equals 1 (sum to count)
-        df_loggers['Logger'] = 1
-
-        # Generate 'Clean Loggers' dummy varible (sum to count)
-        df_loggers['Clean Loggers'] = 1
-        df_loggers.loc[df_loggers['Method'] == 'Drive', 'Clean Loggers'] = 0
-
-        # We can save intermediate results for diagnostic purposes if needed:
-        # df_loggers.to_excel("DF Loggers PreAgg.xlsx", index=False)
-
-        # Collapse to 1 record per user ID. Using "max" means even one clean trip logged makes you a clean logger for counting
-        df_loggers = df_loggers.groupby(['User ID'], as_index=False).agg({'Clean Loggers': 'max', 'Logger': 'max'})
-
-        # Join ESO back to df_loggers
-        df_loggers = df_loggers.merge(df_users[['User ID', 'ESO', 'ESO Adjust State/Fed']], on='User ID', how='left')
-
-
-        # Generate Territory field, which collapses Unknown and Out of region to a single category; also combines all GCO regions into one
-        df_loggers['Territory'] = df_loggers['ESO Adjust State/Fed']
-        df_loggers['Territory'] = df_loggers['Territory'].replace({'Unknown': 'Unknown/Out of Region', 'Out of Region': 'Unknown/Out of Region'})
-        df_loggers.loc[df_loggers['Territory'].str.contains('GCO', na=False), 'Territory'] = 'GCO'
-
-        # Then sum loggers and clean loggers dummies to 'Territory' in order to get counts
-        df_loggers = df_loggers.groupby(['Territory']).agg({'Clean Loggers': 'sum', 'Logger': 'sum'})
-
-        # We can save intermediate results for diagnostic purposes if needed:
-        # df_loggers.to_excel("DF Loggers Test.xlsx", index=True)
+import hashlib
+import importlib.machinery
+import os
 
+from pipeline import bundle, cleaning, engine, ingest, instrument, jobs, periods, preview, spatial
 
+# Streamlit re-runs this whole script on every widget interaction, so parsed and cleaned uploads are memoized by the
+# SHA-256 of their contents and the cleaning rules file, and previews and bundles rebuilt in other output formats are kept
+# in the session. All are capped so a long-lived server doesn't grow without bound.
+MAX_CACHED_UPLOADS = 8
+MAX_SESSION_BUNDLES = 4
+MAX_SESSION_PREVIEWS = 4
 
+# How often a running job's progress is refreshed
+POLL_SECONDS = 2
 
-        # OUTPUT FILE #1 Tableau Excel sheet
-        # This report wants one record per O/D Pair by Method. We use the unadjusted ESO for this report.
+# Job workers are spawned processes (see pipeline/jobs.py), and a spawned process first re-runs the main script, which under
+# Streamlit is this page, unless the script's spec names it plain __main__. The workers only need the pipeline package.
+__spec__ = importlib.machinery.ModuleSpec("__main__", None)
 
-        # Collapse the individual level data to one record per Method/ESO/Home ZIP triplet
-        df_tableau = df_individual.groupby(['Method','ESO', 'Home ZIP']).sum().reset_index()
-        df_tableau.drop(columns=['User ID'], inplace=True)
 
+def upload_digest(upload):
+    return hashlib.sha256(upload.getvalue()).hexdigest()
 
-        # Add a date field, then keep only required columns in their desired order
-        df_tableau['Date'] = startDate
-        keep_columns = ['Date', 'Home ZIP','ESO', 'Method', 'Trips', 'Miles', 'VMR','CO2','Dollars']
-        df_tableau = df_tableau[keep_columns]
 
-        # We don't want drivers in the viz:
-        df_tableau = df_tableau[df_tableau['Method'] != 'drive']
+@st.cache_data(max_entries=MAX_CACHED_UPLOADS, show_spinner="Reading the Users Report...")
+def load_users(digest, rules_version, _upload):
+    _upload.seek(0)
+    return engine.load_users(_upload)
 
-        # Sort by ZIP, ESO, and Method
-        df_tableau = df_tableau.sort_values(by=['Home ZIP', 'ESO', 'Method'])
 
-        # Export!
-        # df_tableau.to_excel("c:\data\Tableau Test.xlsx", index=False)
+@st.cache_data(max_entries=MAX_CACHED_UPLOADS, show_spinner=False)
+def count_locations(digest, rules_version, _df_users):
+    return spatial.distinct_locations(_df_users)
 
 
+@st.cache_data(max_entries=MAX_CACHED_UPLOADS, show_spinner="Reading the Trips Report...")
+def load_trips(digest, rules_version, _upload):
+    _upload.seek(0)
+    return engine.load_trips(_upload)
 
 
+st.title("RideAmigos Report Processing")
 
-        # OUTPUT FILE #2: GDOT Report
-        # This report wants one line per ESO, called "Territory", and using the ESO Adjusted for State/Fed
-        # Data Fields: "New Users", "Loggers",  "Clean Loggers", "Carpool Logs", "Vanpool Logs", "Transit Logs", "Telework Logs",
-        #              "Walk Logs", "Bike Logs", "Scooter Logs", "CWW Logs", "Reduced VMT", "Reduced CO2 (pounds)" 
-
-
-
-        # Start with the individual-level data:
-        # Create a new field, Territory, which combines all GCO regions into one category and also combines unknown and out of region into one category.
-
-        df_individual_adjusted['Territory'] = df_individual_adjusted['ESO Adjust State/Fed']
-        df_individual_adjusted['Territory'] = df_individual_adjusted['Territory'].replace({'Unknown': 'Unknown/Out of Region', 'Out of Region': 'Unknown/Out of Region'})
-        df_individual_adjusted.loc[df_individual_adjusted['Territory'].str.contains('GCO', na=False), 'Territory'] = 'GCO'
-
-        # We can save intermediate results for diagnostic purposes if needed:
-        # df_individual_adjusted.to_excel("Pre-Agg Test.xlsx", index=False)
-
-        # Aggregate Individual-level data to ESO, then drop unneded fields
-        df_gdot = df_individual_adjusted.groupby(['Territory']).sum().reset_index()
-
-        # We can save intermediate results for diagnostic purposes if needed:
-        # df_gdot.to_excel("Count Test.xlsx", index=False)
-
-
-        # CO2 is in grams create new field with value converted to pounds:
-        df_gdot['Reduced CO2 (pounds)'] = df_gdot['CO2'] * 0.00220462
-        # df_gdot['Reduced CO2 (pounds)'] = df_gdot['CO2'] * 0.00220462262
-
-
-        # Rename fields to desired output names for the GDOT report
-        df_gdot = df_gdot.rename(columns={'VMR':'Reduced VMT', 'Dollars':'Money Saved'})
-
-
-        # Now Transition to the Users data; count new users by territory
-
-        df_users['Territory'] = df_users['ESO Adjust State/Fed']
-        df_users['Territory'] = df_users['Territory'].replace({'Unknown': 'Unknown/Out of Region', 'Out of Region': 'Unknown/Out of Region'})
-        df_users.loc[df_users['Territory'].str.contains('GCO', na=False), 'Territory'] = 'GCO'
-        df_gdot_newusers = df_users.groupby('Territory').sum('New User').reset_index()
-
-        # Add the new user field to the gdot
-        df_gdot = df_gdot.merge(df_gdot_newusers, on='Territory', how='inner')
-
-
-        # Now transition to the Trips data:
-
-        # Again, create a new Territory field
-        df_trips['Territory'] = df_trips['ESO Adjust State/Fed']
-        df_trips['Territory'] = df_trips['Territory'].replace({'Unknown': 'Unknown/Out of Region', 'Out of Region': 'Unknown/Out of Region'})
-        df_trips.loc[df_trips['Territory'].str.contains('GCO', na=False), 'Territory'] = 'GCO'
-
-        # Collapse to Territory
-        df_gdot_long = df_trips.groupby(['Territory', 'Method']).sum().reset_index()
-        keep_columns = ['Territory','Method','Logs']
-        df_gdot_long = df_gdot_long[keep_columns]
-
-        # We can save intermediate results for diagnostic purposes if needed:
-        # df_gdot_long.to_excel("Test GDOT Long.xlsx", index=False)
-
-
-        # Reshaping from long to wide format (and dumping the "Drive" column because we don't report driving trips to GDOT)
-
-        df_gdot_wide = df_gdot_long.pivot(index='Territory', columns='Method', values='Logs')
-        df_gdot_wide.reset_index(inplace=True)
-
-        df_gdot_wide.drop(columns=['Drive'], inplace=True)
-
-        # Changing nulls to zeroes and renaming fields to desired output names
-
-        columns_to_replace = ['Bike', 'Carpool', 'CWW', 'Scooter', 'Telework', 'Transit', 'Vanpool', 'Walk']
-        df_gdot_wide[columns_to_replace] = df_gdot_wide[columns_to_replace].fillna(0)
-
-        df_gdot_wide = df_gdot_wide.rename(columns={'Bike':'Bike Logs', 'Carpool': 'Carpool Logs', 'CWW':'CWW Logs', 'Scooter':'Scooter Logs', 
-                                                    'Telework': 'Telework Logs', 'Transit': 'Transit Logs', 'Vanpool':'Vanpool Logs', 'Walk': 'Walk Logs'})
-
-
-        # We can save intermediate results for diagnostic purposes if needed:
-        # df_gdot_wide.to_excel("Test GDOT Wide.xlsx", index=False)
-
-        # Add the fields from df_gdot_wide to the main df_gdot dataframe
-        df_gdot = df_gdot.merge(df_gdot_wide, on='Territory', how='inner')
-
-        # And now also the Loggers and Clean Loggers fields from the df_loggers dataframs
-        df_gdot = df_gdot.merge(df_loggers, on='Territory', how='inner')
-
-        # And rename "Logger" to "Loggers" to match desierd output
-        df_gdot.rename(columns={'Logger':'Loggers'}, inplace = True)
-
-        # Keep just what we need in the desired order
-        keep_columns = ['Territory', 'New Users', 'Loggers', 'Clean Loggers', 'Carpool Logs', 'Vanpool Logs', 'Transit Logs','Telework Logs','Walk Logs',
-                        'Bike Logs', 'Scooter Logs', 'CWW Logs', 'Reduced VMT', 'Reduced CO2 (pounds)', 'Money Saved']
-        df_gdot = df_gdot[keep_columns]
-
-
-        # Export!
-        # df_gdot.to_excel("c:\data\GDOT Report Test.xlsx", index=False)
-
-
-
-        # OUTPUT FILE #3: TDM VIZ
-
-        # Start with the Users Dataframe: create a new df with just the fields we need
-        # Using the unadjusted for now?
-
-        df_tdm = df_users[['User ID', 'LonHome', 'LatHome', 'LonWork', 'LatWork', 'Active Account', 'New Users', 'Created', 
-                        'Work County FIPS', 'Work County Name', 'Work ZIP', 'Home County FIPS', 'Home County Name', 'Home ZIP',
-                        'Legacyid', 'ESO', 'Tmas']].copy()
-
-        # Add a month field
-        df_tdm['Month'] = startDate
-
-        # Legacy is blank if there's no legacy ID, and takes a value of 1 if there is one:
-        df_tdm['Legacy'] = np.nan 
-        df_tdm.loc[df_tdm['Legacyid'] != "", 'Legacy'] = 1 
-
-        # Rename fields to have the desired output names
-        df_tdm.rename(columns={'User ID': 'User_ID', 'LonHome': 'Home_X', 'LatHome': 'Home_Y', 'LonWork': 'Work_X', 
-                            'LatWork': 'Work_Y', 'Active Account': 'Active', 'New Users': 'New', 'Created': 'Created_Date', 
-                            'Work County FIPS': 'County_ID_Work', 'Work County Name': 'County_Work', 'Work ZIP': 'Zip_Code_Work', 
-                            'Home County FIPS': 'County_ID_Home', 'Home County Name': 'County_Home', 'Home ZIP': 'Zip_Code_Home'}, inplace = True)
-
-        # Next, we move to the df_individual dataframe (contains one aggregated record per user); using unadjusted ESO
-
-        # Convert grams to pounds
-        df_individual['CO2_lbs'] = df_individual['CO2'] * 0.00220462
-
-
-        # Reshape long to wide
-
-        df_individual_wide = df_individual.pivot(index='User ID', columns='Method', values=['Trips', 'Miles', 'VMR', 'CO2_lbs', 'Dollars']).reset_index()
-        df_individual_wide.columns = [f"{method}_{var}" if method else var for var, method in df_individual_wide.columns]
-        df_individual_wide.rename(columns={'User ID': 'User_ID'}, inplace=True)
-
-
-        # We can save intermediate results for diagnostic purposes if needed:
-        # df_individual_wide.to_excel("Test Individual Wide.xlsx", index=True)
-
-        # Add the df_individual_wide data to the main TDM dataframe
-        df_tdm = df_tdm.merge(df_individual_wide, on='User_ID', how='left')
-
-
-        # Replace missing values with zeroes
-        patterns = ['Trips', 'Miles', 'VMR', 'CO2_lbs', 'Dollars']
-        columns_to_replace = [col for col in df_tdm.columns if any(pattern in col for pattern in patterns)]
-        df_tdm[columns_to_replace] = df_tdm[columns_to_replace].fillna(0)
-
-        # Create Clean fields and Loggers fields
-        # Initialize aggregated columns
+startDate = st.date_input("Select the first date of the reporting period", datetime.date.today())
+endDate = st.date_input("Select the last date of the reporting period", datetime.date.today())
 
-        df_tdm["Clean_Trips"] = 0
-        df_tdm["Clean_Miles"] = 0
-        df_tdm["Clean_VMR"] = 0
-        df_tdm["Clean_CO2_lbs"] = 0
-        df_tdm["Clean_Dollars"] = 0
+# Junk/test record exclusions are read from cleaning_rules.json; editing it takes effect on the next upload or rerun
+rules_version = cleaning.rules_version()
 
-        # Create "Clean" totals for trips, miles, VMR, CO2 reduction, and dollars saved by summing across all of the different modes 
-        modes = ["Bike", "Carpool", "CWW", "Scooter", "Telework", "Transit", "Vanpool", "Walk"]
-        for mode in modes:
-            df_tdm[f"{mode}_Logger"] = np.where(df_tdm[f"{mode}_Trips"].fillna(0) > 0, 1, np.nan)
-            
-            df_tdm["Clean_Trips"] += df_tdm[f"{mode}_Trips"].fillna(0)
-            df_tdm["Clean_Miles"] += df_tdm[f"{mode}_Miles"].fillna(0)
-            df_tdm["Clean_VMR"] += df_tdm[f"{mode}_VMR"].fillna(0)
-            df_tdm["Clean_CO2_lbs"] += df_tdm[f"{mode}_CO2_lbs"].fillna(0)
-            df_tdm["Clean_Dollars"] += df_tdm[f"{mode}_Dollars"].fillna(0)
 
-        # Create Clean_Logger column
-        df_tdm["Clean_Logger"] = np.where(df_tdm["Clean_Trips"] > 0, 1, np.nan)
+user_file = st.file_uploader("Choose the Users Report", type=ingest.FILE_TYPES)
+if user_file is not None:
+    users_digest = upload_digest(user_file)
+    df_users, load_stats, removed = load_users(users_digest, rules_version, user_file)
+    st.write(f"File uploaded! Read {load_stats.rows:,} rows in {load_stats.seconds:.1f}s ({ingest.rows_per_second(load_stats):,.0f} rows/s)")
+    st.write(f"Removed {sum(removed.values()):,} junk/test records ({cleaning.describe(removed)})")
 
+    st.subheader("Users Data Preview")
+    st.write(df_users.head())
+else: 
+   st.write("Waiting for upload.")
 
-        # Rename Tmas to TMA to match desired column name in output
-        df_tdm.rename(columns={'Tmas': 'TMA'}, inplace=True)
+trip_file = st.file_uploader("Choose the Trips Report", type=ingest.FILE_TYPES)
+# Multi-year exports may not fit in memory: streaming reads, cleans and aggregates the trips a chunk at a time instead
+stream_trips = st.checkbox("Stream the Trips Report in chunks (uses much less memory on very large exports)")
+if trip_file is not None:
+    trips_digest = upload_digest(trip_file)
+    if stream_trips:
+        trip_file.seek(0)
+        df_trips_preview = next(ingest.iter_trips(trip_file, chunk_rows=5), None)
+        st.write("File uploaded! The trips will be read in chunks of "
+                 f"{ingest.CHUNK_ROWS:,} rows when the records are processed.")
+    else:
+        df_trips, load_stats, removed = load_trips(trips_digest, rules_version, trip_file)
+        st.write(f"File uploaded! Read {load_stats.rows:,} rows in {load_stats.seconds:.1f}s ({ingest.rows_per_second(load_stats):,.0f} rows/s)")
+        st.write(f"Removed {sum(removed.values()):,} junk/test records ({cleaning.describe(removed)})")
+        df_trips_preview = df_trips.head()
 
-        # Reorder to match desired output
-        keep_columns = ['User_ID', 'Home_X', 'Home_Y', 'Work_X', 'Work_Y', 'TMA', 'Legacy', 'Active', 'New', 'Created_Date', 
-                        'Bike_Logger', 'Bike_Trips', 'Bike_Miles', 'Bike_VMR', 'Bike_CO2_lbs', 'Bike_Dollars', 
-                        'Carpool_Logger', 'Carpool_Trips', 'Carpool_Miles', 'Carpool_VMR', 'Carpool_CO2_lbs', 'Carpool_Dollars', 
-                        'CWW_Logger', 'CWW_Trips', 'CWW_Miles', 'CWW_VMR', 'CWW_CO2_lbs', 'CWW_Dollars', 
-                        'Scooter_Logger', 'Scooter_Trips', 'Scooter_Miles', 'Scooter_VMR', 'Scooter_CO2_lbs', 'Scooter_Dollars', 
-                        'Telework_Logger', 'Telework_Trips', 'Telework_Miles', 'Telework_VMR', 'Telework_CO2_lbs', 'Telework_Dollars', 
-                        'Transit_Logger', 'Transit_Trips', 'Transit_Miles', 'Transit_VMR', 'Transit_CO2_lbs', 'Transit_Dollars', 
-                        'Vanpool_Logger', 'Vanpool_Trips', 'Vanpool_Miles', 'Vanpool_VMR', 'Vanpool_CO2_lbs', 'Vanpool_Dollars', 
-                        'Walk_Logger', 'Walk_Trips', 'Walk_Miles', 'Walk_VMR', 'Walk_CO2_lbs', 'Walk_Dollars', 
-                        'Clean_Logger', 'Clean_Trips', 'Clean_Miles', 'Clean_VMR', 'Clean_CO2_lbs', 'Clean_Dollars', 
-                        'Month', 'County_ID_Work', 'County_Work', 'Zip_Code_Work', 'ESO', 'County_ID_Home', 'County_Home', 'Zip_Code_Home']
-        df_tdm = df_tdm[keep_columns]
+    st.subheader("Trips Data Preview")
+    st.write(df_trips_preview)
+else: 
+   st.write("Waiting for upload.")
 
-        # keep only active users
-        df_tdm = df_tdm[df_tdm['Active'] == 1]
 
-        # Export! 
-        # df_tdm.to_excel("c:\data\TDM Report Test.xlsx", index=False)
+# Excel by default; the machine-readable formats are much faster to write and have no row limit
+st.subheader("Output Formats")
+output_formats = {
+    name: st.selectbox(f"{os.path.splitext(name)[0]} format", list(bundle.FORMATS), format_func=bundle.FORMAT_LABELS.get, key=f"format {name}")
+    for name in engine.REPORT_FILES
+}
 
 
+def bundle_name(prefix, formats):
+    """Keep the familiar name when everything is Excel."""
+    return f"{prefix}excel_files_bundle.zip" if set(formats) == {"xlsx"} else f"{prefix}report_files_bundle.zip"
 
-        # OUTFILE #4: Data Audit: Flag records where ESO from spatial join does not match 'Tmas' in Ride Amigos  
 
-        df_diff = df_users[['User ID', 'First Name', 'Last Name', 'Work Location', 'Tmas', 'ESO']].copy()
-        df_diff = df_diff.rename(columns={'Tmas': 'TMA', 'ESO': 'ESO Geocoded'})
+if trip_file is not None and user_file is not None: 
+    run_key = (users_digest, trips_digest, rules_version, startDate, endDate)
+
+    # A quick check before the full run: the Tableau and GDOT reports estimated from a sample of the users, stratified by
+    # network and ESO (see pipeline/preview.py), catches the wrong month's export or date range in seconds. It needs the
+    # trips in memory, so it isn't offered when streaming.
+    if not stream_trips:
+        st.subheader("Preview")
+        previews = st.session_state.setdefault("previews", {})
+        if st.button("PREVIEW SAMPLE"):
+            with st.spinner("Estimating the reports from a sample of the users..."):
+                previews[run_key] = preview.run(df_users, df_trips, startDate, endDate)
+            while len(previews) > MAX_SESSION_PREVIEWS:
+                previews.pop(next(iter(previews)))
+        if run_key in previews:
+            sample = previews[run_key]
+            st.warning(
+                f"SCALED ESTIMATES: from {sample.sampled_users:,} of {sample.total_users:,} users ({sample.sampled_trips:,} of "
+                f"{sample.total_trips:,} trip records), sampled within each network and ESO and scaled up. Use them to check the "
+                "inputs, not for reporting; process the records below for the actual reports."
+            )
+            st.write("GDOT Report (estimated)")
+            st.dataframe(sample.gdot, hide_index=True)
+            st.write("Tableau (estimated)")
+            st.dataframe(sample.tableau, hide_index=True)
 
-        # Remove colons from ESO Geocoded to match what is in TMA
-        df_diff['ESO Geocoded'] = df_diff['ESO Geocoded'].str.replace(":", "", regex=True)
+    st.subheader("Process Records")
+    st.write(f"Click the button below to process records for the period {startDate} through {endDate}.")
 
-        # Replace specific values to match what is in TMA
-        df_diff.loc[df_diff['ESO Geocoded'].isin(["Out of Region", "Unknown"]), 'ESO Geocoded'] = "Unknown/Out of Region"
-        df_diff.loc[df_diff['ESO Geocoded'] == "Midtown Transportation", 'ESO Geocoded'] = "Midtown Alliance"
-        df_diff.loc[df_diff['ESO Geocoded'] == "ASAP", 'ESO Geocoded'] = "Atlantic Station (ASAP)"
+    # The spatial join is split across processes only when more than spatial.PARALLEL_CHUNK distinct locations need looking
+    # up (below that it's faster in one process), so the worker count is only offered for uploads that large; 1 runs it
+    # serially. Results are the same either way.
+    spatial_workers = None
+    if count_locations(users_digest, rules_version, df_users) > spatial.PARALLEL_CHUNK:
+        spatial_workers = st.number_input(
+            "Spatial join workers", min_value=1, max_value=os.cpu_count() or 1, value=os.cpu_count() or 1, step=1,
+            help=f"Used when more than {spatial.PARALLEL_CHUNK:,} of the distinct home/work locations need looking up (ones in "
+                 "the location cache don't count); a repeat run of mostly the same users runs in a single process.",
+        )
 
-        # Change Null values of TMA to "Unknown/Out of Region"
-        df_diff['TMA'] = df_diff['TMA'].fillna("Unknown/Out of Region")
+    # For debugging: snapshot every intermediate table (enriched users, trip cube, df_individual, the wide pivots...) in the
+    # job's directory; they can be read with pd.read_feather, and pipeline.cli can resume from them (see pipeline/checkpoints.py)
+    save_checkpoints = st.checkbox("Save stage checkpoints")
 
-        # Keep only rows where the contents of ESO Geocoded is different from what was in TMA
-        df_diff = df_diff.loc[df_diff['ESO Geocoded'] != df_diff['TMA']]
+    # Processing runs as a background job (see pipeline/jobs.py), so reloading the page or touching a widget doesn't lose it
+    # and several people can process at once. Submitting the same uploads, rules and period again reuses the earlier job.
+    # The job id goes in the page URL, so a reloaded page picks the job back up. Unless streaming, the job starts from the
+    # uploads as already read and cleaned here (the same inputs as the preview) rather than reading them again.
+    # Clean -> enrich -> aggregate -> report (see pipeline/engine.py). This period's partial aggregates are saved so
+    # quarterly/YTD reports can later be assembled from stored periods without the raw exports.
+    if st.button("PROCESS RECORDS"):
+        st.query_params["job"] = jobs.submit(
+            user_file, trip_file, startDate, endDate, key=run_key + (save_checkpoints,),
+            stream=stream_trips, formats=output_formats, spatial_workers=spatial_workers, checkpoints=save_checkpoints,
+            cleaned=None if stream_trips else (df_users, df_trips),
+        )
 
-        # Export!
-        # df_diff.to_excel("c:\data\ESO Audit Test.xlsx", index=False)
 
+@st.fragment(run_every=POLL_SECONDS)
+def job_progress(job_id):
+    """Progress of a queued or running job, refreshed every POLL_SECONDS; reruns the page once the job is over."""
+    job = jobs.status(job_id)
+    if job is None or job["state"] not in jobs.ACTIVE:
+        st.rerun()
+    elif job["state"] == jobs.QUEUED:
+        st.progress(0.0, text="Queued: waiting for other jobs to finish...")
+    else:
+        # Every stage is timed (wall time, peak memory, rows in/out); the bar advances as each top-level stage finishes
+        # and its label shows whichever step is running now
+        st.progress(job["progress"], text=f"Working: {job['stage'] or 'starting'}...")
+
+
+job_id = st.query_params.get("job")
+job = jobs.status(job_id) if job_id else None
+if job is not None:
+    st.subheader(f"Job {job['id']}")
+    st.write(f"{job['users_file']} and {job['trips_file']} for {job['start']} through {job['end']}, submitted {job['submitted']}")
+
+    if job["state"] in jobs.ACTIVE:
+        job_progress(job["id"])
+    elif job["state"] == jobs.FAILED:
+        st.error(f"Processing failed: {job['error']}")
+    else:
         st.subheader("Processing Complete")
-
-
-        # Create a BytesIO buffer for the ZIP file
-        zip_buffer = io.BytesIO()
-
-        with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED) as zip_file:
-            # Create Excel files in memory and add them to the ZIP
-            for df, name in zip([df_tableau, df_gdot, df_tdm, df_diff], ["Tableau.xlsx", "GDOT Report.xlsx", "TDM.xlsx", "ESO Audit.xlsx"]):
-                excel_buffer = io.BytesIO()
-                with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False)
-                zip_file.writestr(name, excel_buffer.getvalue())
-
-        zip_buffer.seek(0)
+        if job["removed_trips"] is not None:
+            st.write(f"Removed {sum(job['removed_trips'].values()):,} junk/test trip records ({cleaning.describe(job['removed_trips'])})")
+        st.write(f"Location cache: {job['cache_hits']} hits, {job['cache_misses']} misses")
+        if job.get("checkpoints"):
+            st.write(f"Stage checkpoints saved in {jobs.checkpoint_path(job)}")
+
+        st.write("Stage timings")
+        st.dataframe(instrument.frame(job["stages"]), hide_index=True)
+
+        # The job wrote its bundle in the output formats chosen when it was submitted. Other formats are written from its saved
+        # report frames, and kept for this session so reruns (including clicking download) don't redo them.
+        if output_formats == job["formats"]:
+            with open(jobs.bundle_path(job), "rb") as f:
+                zip_bytes = f.read()
+        else:
+            bundles = st.session_state.setdefault("bundles", {})
+            bundle_key = (job["id"], tuple(output_formats.items()))
+            if bundle_key not in bundles:
+                with st.spinner("Writing the reports in the new formats..."):
+                    bundles[bundle_key] = bundle.bundle_bytes(jobs.load_reports(job), formats=output_formats)
+                while len(bundles) > MAX_SESSION_BUNDLES:
+                    bundles.pop(next(iter(bundles)))
+            zip_bytes = bundles[bundle_key]
 
         # Download button for the ZIP
         st.download_button(
-            label="📦 Download All Excel Files",
-            data=zip_buffer,
-            file_name="excel_files_bundle.zip",
+            label="📦 Download All Report Files",
+            data=zip_bytes,
+            file_name=bundle_name("", output_formats.values()),
             mime="application/zip"
         )
 
 
-        # Diagnostic if needed
-        # print(df_tableau.columns.tolist())
-
-
-
-
+def open_job():
+    """Open the job just picked in "Open a job".
+
+    Runs only when the selection changes (before the rerun), and clears it, so the selection doesn't hold on to that job
+    when PROCESS RECORDS later puts a new one in the URL.
+    """
+    if st.session_state["open_job"] is not None:
+        st.query_params["job"] = st.session_state["open_job"]
+        st.session_state["open_job"] = None
+
+
+# Finished bundles are kept for a week; any recent job can be reopened here
+recent_jobs = jobs.recent()
+if recent_jobs:
+    st.subheader("Recent Jobs")
+    st.dataframe(
+        [{"Job": j["id"], "Period": f"{j['start']} through {j['end']}", "Trips Report": j["trips_file"], "State": j["state"]} for j in recent_jobs],
+        hide_index=True,
+    )
+    st.selectbox("Open a job", [None] + [j["id"] for j in recent_jobs], format_func=lambda j: "" if j is None else j,
+                 key="open_job", on_change=open_job)
+
+
+def describe_period(period):
+    return f"{period.start} through {period.end}: {period.label or 'earlier run'} (saved {period.saved})"
+
+
+# Combine the partial aggregates saved by earlier runs into quarterly/YTD Tableau and GDOT reports. Each processed export is
+# stored separately, so the same period can be picked once per network export (but not the same export twice).
+period_store = periods.PeriodStore()
+stored_periods = period_store.periods()
+if stored_periods:
+    st.subheader("Combine Stored Periods")
+    chosen_periods = st.multiselect("Select the processed periods to combine", stored_periods, format_func=describe_period)
+
+    combined = st.session_state.setdefault("combined", {})
+    combined_formats = {name: output_formats[name] for name in ["Tableau.xlsx", "GDOT Report.xlsx"]}
+    combined_key = (tuple(sorted(chosen_periods)), tuple(combined_formats.items()))
+    first_start = min(p.start for p in chosen_periods) if chosen_periods else None
+    last_end = max(p.end for p in chosen_periods) if chosen_periods else None
+    if chosen_periods and st.button("BUILD COMBINED REPORTS") and combined_key not in combined:
+        try:
+            partials = period_store.combine(chosen_periods)
+        except ValueError as error:
+            st.error(str(error))
+        else:
+            df_tableau, df_gdot = periods.build_reports(partials, first_start)
+            combined[combined_key] = bundle.bundle_bytes({"Tableau.xlsx": df_tableau, "GDOT Report.xlsx": df_gdot}, formats=combined_formats)
+            while len(combined) > MAX_SESSION_BUNDLES:
+                combined.pop(next(iter(combined)))
+
+    if combined_key in combined:
+        st.download_button(
+            label="📦 Download Combined Report Files",
+            data=combined[combined_key],
+            file_name=f"combined_{first_start}_{last_end}.zip",
+            mime="application/zip"
+        )
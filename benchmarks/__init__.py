@@ -0,0 +1 @@
+"""Synthetic data and stage-level benchmarks for the processing pipeline (see benchmarks.run)."""
@@ -0,0 +1,43 @@
+"""Compare two benchmark result files stage by stage.
+
+    python -m benchmarks.compare before.json after.json
+"""
+
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        results = json.load(f)
+    return {(run["trip_rows"], stage["stage"]): stage for run in results["runs"] for stage in run["stages"]}
+
+
+def ratio(before, after):
+    if before is None or after is None or not before:
+        return ""
+    return f"{after / before:6.2f}x"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare", description="Compare two benchmark result files.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args(argv)
+
+    before, after = load(args.before), load(args.after)
+    print(f"{'rows':>10}  {'stage':<16} {'before s':>10} {'after s':>10} {'time':>7}  {'before MB':>10} {'after MB':>10} {'memory':>7}")
+    for key in before:
+        if key not in after:
+            continue
+        b, a = before[key], after[key]
+        b_mb = f"{b['peak_mb']:10.1f}" if b["peak_mb"] is not None else f"{'':>10}"
+        a_mb = f"{a['peak_mb']:10.1f}" if a["peak_mb"] is not None else f"{'':>10}"
+        print(f"{key[0]:>10,}  {key[1]:<16} {b['seconds']:10.3f} {a['seconds']:10.3f} {ratio(b['seconds'], a['seconds']):>7}  "
+              f"{b_mb} {a_mb} {ratio(b['peak_mb'], a['peak_mb']):>7}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
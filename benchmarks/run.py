@@ -0,0 +1,159 @@
+"""Stage-level benchmarks: wall time and peak memory of each pipeline stage.
+
+For each size, synthetic Users/Trips reports are written (see
+benchmarks.synthetic) and pushed through the same stages the app runs, each
+timed on its own: ingest, clean, spatial join, new-user flags, aggregation,
+each report and the ZIP bundle. Peak memory is measured with tracemalloc in
+a separate run of the stage, so tracing doesn't inflate the timings.
+
+Results are written as JSON so runs can be compared (see benchmarks.compare):
+
+    python -m benchmarks.run                          # 10k, 100k and 1M trip rows
+    python -m benchmarks.run --sizes 10000 --repeat 3 --out before.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+from pipeline import boundaries as boundary_store
+from pipeline import bundle, cleaning, engine, ingest, reports
+from pipeline.config import ROOT_DIR
+
+SIZES = [10_000, 100_000, 1_000_000]
+
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+
+# Reporting period used for the new-user flags and report dates
+START_DATE = datetime.date(2025, 1, 1)
+END_DATE = datetime.date(2025, 1, 31)
+
+
+def row_count(result):
+    """Rows in a stage's output (a dataframe, or a tuple starting with one); None for anything else."""
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return len(result)
+    return None
+
+
+def measure(stage, func, rows_in=None, repeat=1, trace_memory=True):
+    """Run `func` `repeat` times (best time wins), then once more under tracemalloc. Returns (result, record)."""
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - started)
+
+    peak_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+        finally:
+            tracemalloc.stop()
+
+    record = {"stage": stage, "seconds": min(seconds), "peak_mb": peak_mb, "rows_in": rows_in, "rows_out": row_count(result)}
+    print(f"  {stage:<16} {record['seconds']:9.3f}s" + (f" {peak_mb:10.1f} MB" if peak_mb is not None else ""), flush=True)
+    return result, record
+
+
+def bench_size(trip_rows, work_dir, file_type="xlsx", repeat=1, trace_memory=True, seed=0):
+    """Benchmark every stage on `trip_rows` synthetic trips. Returns the run's record."""
+    started = time.perf_counter()
+    users_path, trips_path = synthetic.write_reports(trip_rows, work_dir, file_type, seed)
+    print(f"{trip_rows:,} trip rows: generated in {time.perf_counter() - started:.1f}s", flush=True)
+
+    stages = []
+
+    def run(stage, func, rows_in=None):
+        result, record = measure(stage, func, rows_in, repeat, trace_memory)
+        stages.append(record)
+        return result
+
+    boundaries = boundary_store.load_boundaries()
+    rules = cleaning.load_rules()
+
+    df_users, _ = run("ingest_users", lambda: ingest.read_users(users_path))
+    df_trips, _ = run("ingest_trips", lambda: ingest.read_trips(trips_path))
+    df_users, _ = run("clean_users", lambda: cleaning.clean_users(df_users, rules), len(df_users))
+    df_trips, _ = run("clean_trips", lambda: cleaning.clean_trips(df_trips, rules), len(df_trips))
+    df_users = run("spatial_join", lambda: engine.enrich_users(df_users, boundaries), len(df_users))
+    df_users = run("new_users", lambda: engine.flag_new_users(df_users, START_DATE, END_DATE), len(df_users))
+    partials = run("aggregate", lambda: engine.aggregate(df_trips, df_users), len(df_trips))
+    df_individual, df_individual_adjusted = run("individual", lambda: reports.individual_tables(partials.individual), len(partials.individual))
+
+    run_reports = engine.Reports(
+        tableau=run("report_tableau", lambda: reports.tableau_report(df_individual, START_DATE), len(df_individual)),
+        gdot=run("report_gdot", lambda: reports.gdot_report(df_individual_adjusted, partials.territory_logs, partials.new_users), len(df_individual_adjusted)),
+        tdm=run("report_tdm", lambda: reports.tdm_report(df_users, df_individual, START_DATE), len(df_users)),
+        audit=run("report_audit", lambda: reports.audit_report(df_users), len(df_users)),
+    )
+    frames = engine.report_frames(run_reports)
+    run("bundle", lambda: bundle.bundle_bytes(frames), sum(len(df) for df in frames.values()))
+
+    return {"trip_rows": trip_rows, "user_rows": stages[0]["rows_out"], "stages": stages}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Time and memory-profile each pipeline stage on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="trip rows per run (default: 10k 100k 1M)")
+    parser.add_argument("--type", default="xlsx", choices=["xlsx", "csv", "parquet"], help="report file type to ingest (default: xlsx)")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per stage; the best is kept (default: 1)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run of each stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="results file (default: benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "environment": environment(),
+        "file_type": args.type,
+        "repeat": args.repeat,
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in args.sizes:
+            results["runs"].append(bench_size(size, work_dir, args.type, args.repeat, not args.no_memory, args.seed))
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"wrote {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""Synthetic RideAmigos Users and Trips reports for benchmarking.
+
+The reports have the same columns (names and formats) the app reads, plus a
+few it doesn't, so column pruning is exercised too. Home and work
+coordinates are sampled from the boundary files in data/: some inside an
+ESO, some elsewhere in Georgia, some outside the state and some missing.
+Work locations are drawn from a smaller pool of sites, since many users
+share a workplace. A small share of users and trips match the exclusions in
+cleaning_rules.json, so the cleaning stage has something to remove.
+
+    python -m benchmarks.synthetic --trips 100000 --out-dir /tmp/synthetic
+"""
+
+import argparse
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from pipeline import bundle, cleaning, dimensions, spatial
+from pipeline.boundaries import load_boundaries
+
+# One user for every this many trip rows
+TRIPS_PER_USER = 10
+
+# Share of home/work locations that are (inside an ESO, elsewhere in Georgia, outside Georgia); the rest are missing
+HOME_MIX = (0.45, 0.40, 0.05)
+WORK_MIX = (0.65, 0.25, 0.05)
+
+# Users sharing each work site, on average
+USERS_PER_SITE = 20
+
+# Share of users/trips matching a cleaning rule
+JUNK_SHARE = 0.02
+
+MODES = ["drive", "carpool", "transit", "telework", "walk", "bike", "vanpool", "cww", "scooter"]
+MODE_WEIGHTS = [0.30, 0.18, 0.15, 0.20, 0.05, 0.04, 0.03, 0.04, 0.01]
+
+NETWORKS = ["Georgia Commute Options", "Georgia Commute Options; Perimeter Connects", "Georgia Commute Options; Livable Buckhead"]
+EMAIL_DOMAINS = ["gmail.com", "yahoo.com", "outlook.com", "emory.edu", "gatech.edu", "coca-cola.com", "delta.com"]
+EMPLOYERS = ["Emory University", "Georgia Tech", "The Coca-Cola Company", "Delta Air Lines", "City of Atlanta", "State of Georgia", ""]
+FIRST_NAMES = ["Alex", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn", "Drew"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Lee", "Walker"]
+
+# Grams of CO2 and dollars saved per vehicle mile reduced
+CO2_PER_MILE = 404.0
+DOLLARS_PER_MILE = 0.67
+
+
+def sample_in_bounds(rng, bounds, n):
+    minx, miny, maxx, maxy = bounds
+    return rng.uniform(minx, maxx, n), rng.uniform(miny, maxy, n)
+
+
+def sample_inside(rng, layer, n):
+    """`n` points inside the ESO polygons of `layer`, by rejection sampling over its bounding box."""
+    lon, lat = np.empty(0), np.empty(0)
+    while len(lon) < n:
+        x, y = sample_in_bounds(rng, layer.total_bounds, max(2 * (n - len(lon)), 1000))
+        hit = pd.notna(spatial.locate(shapely.points(x, y), layer, spatial.ESO_FIELD))
+        lon, lat = np.concatenate([lon, x[hit]]), np.concatenate([lat, y[hit]])
+    return lon[:n], lat[:n]
+
+
+def sample_locations(rng, boundaries, n, mix):
+    """`n` "lon,lat" strings mixed per `mix` (see HOME_MIX), in random order; missing ones are NaN."""
+    inside, georgia, outside = (int(round(share * n)) for share in mix)
+    inside_lon, inside_lat = sample_inside(rng, boundaries.eso, inside)
+    georgia_lon, georgia_lat = sample_in_bounds(rng, boundaries.county.total_bounds, georgia)
+    # Well clear of the state: shift points from the Georgia box a few degrees west or north
+    outside_lon, outside_lat = sample_in_bounds(rng, boundaries.county.total_bounds, outside)
+    outside_lon -= 6.0
+    outside_lat += rng.choice([0.0, 4.0], outside)
+
+    lon = np.concatenate([inside_lon, georgia_lon, outside_lon])
+    lat = np.concatenate([inside_lat, georgia_lat, outside_lat])
+    coords = np.full(n, np.nan, dtype=object)
+    coords[:len(lon)] = [f"{x:.6f},{y:.6f}" for x, y in zip(lon, lat)]
+    return coords[rng.permutation(n)]
+
+
+def inject(rng, values, choices, share):
+    """Replace a random `share` of `values` with picks from `choices` (in place)."""
+    choices = list(choices)
+    if not choices:
+        return values
+    hit = rng.random(len(values)) < share
+    values[hit] = rng.choice(choices, hit.sum())
+    return values
+
+
+def make_users(n, boundaries, rules, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.array([f"{0x650000000000000000000000 + i:024x}" for i in range(n)], dtype=object)
+
+    sites = sample_locations(rng, boundaries, max(n // USERS_PER_SITE, 1), WORK_MIX)
+    created = datetime.datetime(2023, 1, 1) + pd.to_timedelta(rng.integers(0, 3 * 365 * 24 * 60, n), unit="min")
+    eso_names = boundaries.eso[spatial.ESO_FIELD].dropna().unique()
+
+    emails = np.array([f"user{i}@{domain}" for i, domain in enumerate(rng.choice(EMAIL_DOMAINS, n))], dtype=object)
+    junk_emails = [f"junk{i}@{domain}" for i, domain in enumerate(rules.get("email_domains", []))] + rules.get("emails", [])
+
+    return pd.DataFrame({
+        "_id": ids,
+        "First Name": rng.choice(FIRST_NAMES, n),
+        "Last Name": rng.choice(LAST_NAMES, n),
+        "Email": inject(rng, emails, junk_emails, JUNK_SHARE),
+        "Networks": inject(rng, rng.choice(NETWORKS, n).astype(object), rules.get("networks", []), JUNK_SHARE),
+        "Employer Name": inject(rng, rng.choice(EMPLOYERS, n).astype(object), rules.get("employers", []), JUNK_SHARE),
+        "Work Location": rng.choice(["Main Office", "Downtown Campus", "Midtown Tower", "Airport", "Remote"], n),
+        "Home Location Coords": sample_locations(rng, boundaries, n, HOME_MIX),
+        "Work Location Coords": sites[rng.integers(0, len(sites), n)],
+        "State/Fed": np.where(rng.random(n) < 0.08, rng.choice(["State", "Federal"], n), None),
+        "Created": created.strftime("%m/%d/%y %I:%M %p"),
+        "Last Login": (created + pd.to_timedelta(rng.integers(0, 90, n), unit="D")).strftime("%m/%d/%y %I:%M %p"),
+        "Active Account": (rng.random(n) < 0.9).astype(int),
+        "Legacyid": np.where(rng.random(n) < 0.2, [f"L{i:07d}" for i in range(n)], None),
+        "Tmas": np.where(rng.random(n) < 0.7, rng.choice([dimensions.audit_alias(eso) for eso in eso_names], n), None),
+        "Phone": None,
+    })
+
+
+def make_trips(n, df_users, rules, seed=0):
+    rng = np.random.default_rng(seed + 1)
+
+    # A few heavy loggers and a long tail, like the real logs
+    weights = 1.0 / np.arange(1, len(df_users) + 1) ** 0.8
+    users = df_users.iloc[rng.choice(len(df_users), n, p=weights / weights.sum())]
+
+    mode = rng.choice(MODES, n, p=MODE_WEIGHTS)
+    trips = rng.choice([1.0, 2.0], n, p=[0.4, 0.6])
+    miles = np.round(rng.lognormal(2.3, 0.7, n) * trips, 2)
+    vmr = np.where(mode == "drive", 0.0, np.where(mode == "carpool", miles / 2, miles))
+    user_names = (users["First Name"] + " " + users["Last Name"]).to_numpy(dtype=object)
+
+    return pd.DataFrame({
+        "User ID": users["_id"].to_numpy(),
+        "Networks": users["Networks"].to_numpy(),
+        "User Email": users["Email"].to_numpy(),
+        "User Name": inject(rng, user_names, rules.get("trip_user_names", []), JUNK_SHARE / 4),
+        "Date": (pd.Timestamp(2025, 1, 1) + pd.to_timedelta(rng.integers(0, 31, n), unit="D")).strftime("%m/%d/%Y"),
+        "Mode": mode,
+        "Trips": trips,
+        "Miles": miles,
+        "Vehicle Miles Reduced": np.round(vmr, 2),
+        "CO2 Savings (grams)": np.round(vmr * CO2_PER_MILE, 1),
+        "Dollars Savings": np.round(vmr * DOLLARS_PER_MILE, 2),
+    })
+
+
+def make_reports(trip_rows, boundaries=None, rules_path=cleaning.RULES_FILE, seed=0):
+    """(df_users, df_trips) with `trip_rows` trips and one user per TRIPS_PER_USER trips."""
+    boundaries = boundaries or load_boundaries()
+    with open(rules_path, encoding="utf-8") as f:
+        rules = json.load(f)
+    df_users = make_users(max(trip_rows // TRIPS_PER_USER, 1), boundaries, rules, seed)
+    return df_users, make_trips(trip_rows, df_users, rules, seed)
+
+
+def write_report(df, path):
+    """Write a report as .xlsx (streamed, like the bundle), .csv or .parquet, going by the extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".xlsx":
+        bundle.write_workbook(df, path)
+    elif extension == ".csv":
+        df.to_csv(path, index=False)
+    elif extension == ".parquet":
+        df.to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Unsupported report type '{extension}'")
+    return path
+
+
+def write_reports(trip_rows, out_dir, file_type="xlsx", seed=0):
+    """Generate and write Users/Trips reports; returns (users path, trips path)."""
+    os.makedirs(out_dir, exist_ok=True)
+    df_users, df_trips = make_reports(trip_rows, seed=seed)
+    return (
+        write_report(df_users, os.path.join(out_dir, f"Users_{trip_rows}.{file_type}")),
+        write_report(df_trips, os.path.join(out_dir, f"Trips_{trip_rows}.{file_type}")),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.synthetic", description="Write synthetic RideAmigos Users/Trips reports.")
+    parser.add_argument("--trips", type=int, default=100_000, help="trip rows (users get one row per %d trips)" % TRIPS_PER_USER)
+    parser.add_argument("--out-dir", default=".", help="where to write the reports")
+    parser.add_argument("--type", default="xlsx", choices=["xlsx", "csv", "parquet"], help="file type (default: xlsx)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    for path in write_reports(args.trips, args.out_dir, args.type, args.seed):
+        print(f"wrote {path}")
+
+
+if __name__ == "__main__":
+    main()
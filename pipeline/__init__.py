@@ -0,0 +1 @@
+"""Processing stages behind the RideAmigos report app (GCO.py)."""
@@ -0,0 +1,150 @@
+"""Compiled boundary store for the ESO, ZCTA and county layers.
+
+Reading and reprojecting the shapefiles (the Georgia ZCTA layer especially) is
+slow, so the layers are compiled once into a single pickle holding only the
+columns the pipeline uses, already in EPSG:4326, together with a grid index
+per layer (see pipeline.grid) that resolves most points without any geometry
+math. The compiled store is keyed
+to the size, mtime and checksum of every source file and is rebuilt
+automatically when any of them change.
+
+Loaded stores are also memoized per process. Streamlit only re-executes the
+main script on a rerun, so every session and rerun served by the same server
+process shares one in-memory copy with its spatial index and prepared
+geometries already built.
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+from collections import namedtuple
+
+import geopandas as gpd
+import shapely
+
+from pipeline import spatial
+from pipeline.grid import GridIndex
+from pipeline.config import CACHE_DIR, DATA_DIR
+
+# Bump when the compiled layout changes so old stores are rebuilt
+FORMAT_VERSION = 2
+
+STORE_FILE = "boundaries.pkl"
+
+# Layer name -> (shapefile, attribute columns kept)
+LAYERS = {
+    "eso": ("Employer_Service_Organizations.shp", [spatial.ESO_FIELD]),
+    "zip": ("tl_2020_13_zcta520.shp", [spatial.ZIP_FIELD]),
+    "county": ("tl_2020_13_county20.shp", [spatial.COUNTY_NAME_FIELD, spatial.COUNTY_FIPS_FIELD]),
+}
+
+# Shapefile sidecars that affect what gpd.read_file returns
+SIDECARS = [".shp", ".shx", ".dbf", ".prj", ".cpg"]
+
+Boundaries = namedtuple("Boundaries", ["eso", "zip", "county", "version", "grids"])
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+def source_files(data_dir=DATA_DIR):
+    """List every file the compiled store depends on."""
+    files = []
+    for shapefile, _ in LAYERS.values():
+        stem = os.path.splitext(os.path.join(data_dir, shapefile))[0]
+        files += [stem + ext for ext in SIDECARS if os.path.exists(stem + ext)]
+    return files
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stat_sources(files):
+    """Cheap (size, mtime) fingerprint used to skip checksumming when nothing was touched."""
+    return {os.path.basename(path): (os.path.getsize(path), os.path.getmtime(path)) for path in files}
+
+
+def compile_layer(path, fields):
+    layer = gpd.read_file(path).to_crs(spatial.CRS)
+    return layer[fields + ["geometry"]].reset_index(drop=True)
+
+
+def warm(layer):
+    """Build the spatial index and prepare the polygons so point lookups can use them."""
+    shapely.prepare(layer.geometry.to_numpy())
+    layer.sindex
+    return layer
+
+
+def read_store(path):
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+
+
+def write_store(path, store):
+    # Write to a temp file and swap it in so concurrent readers never see a partial store
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(store, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def build_store(data_dir, stats, checksums):
+    layers = {name: compile_layer(os.path.join(data_dir, shapefile), fields) for name, (shapefile, fields) in LAYERS.items()}
+    grids = {name: GridIndex.build(layer.geometry.to_numpy()) for name, layer in layers.items()}
+    version = hashlib.sha256(repr((FORMAT_VERSION, sorted(checksums.items()))).encode()).hexdigest()[:16]
+    return {"format": FORMAT_VERSION, "stats": stats, "checksums": checksums, "version": version, "layers": layers, "grids": grids}
+
+
+def load_store(data_dir, cache_dir):
+    files = source_files(data_dir)
+    stats = stat_sources(files)
+    path = os.path.join(cache_dir, STORE_FILE)
+
+    store = read_store(path)
+    if store is not None and store.get("format") == FORMAT_VERSION:
+        if store["stats"] == stats:
+            return store
+        # Files were touched; only rebuild if their contents actually changed
+        checksums = {os.path.basename(f): file_checksum(f) for f in files}
+        if store["checksums"] == checksums:
+            store["stats"] = stats
+            write_store(path, store)
+            return store
+    else:
+        checksums = {os.path.basename(f): file_checksum(f) for f in files}
+
+    store = build_store(data_dir, stats, checksums)
+    write_store(path, store)
+    return store
+
+
+def load_boundaries(data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    """Return the ESO, ZCTA and county layers ready for spatial.enrich_users.
+
+    `version` identifies the boundary data the layers were compiled from and
+    changes whenever a source file's contents change. `grids` holds each
+    layer's grid index, keyed by layer name.
+    """
+    key = (os.path.abspath(data_dir), os.path.abspath(cache_dir))
+    with _lock:
+        stats = stat_sources(source_files(data_dir))
+        cached = _loaded.get(key)
+        if cached is not None and cached[0] == stats:
+            return cached[1]
+
+        store = load_store(data_dir, cache_dir)
+        layers = {name: warm(layer) for name, layer in store["layers"].items()}
+        boundaries = Boundaries(layers["eso"], layers["zip"], layers["county"], store["version"], store["grids"])
+        _loaded[key] = (store["stats"], boundaries)
+        return boundaries
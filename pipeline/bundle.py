@@ -0,0 +1,187 @@
+"""Packaging report dataframes into a downloadable ZIP.
+
+Each report is written as an Excel workbook by default, or as gzipped CSV,
+Parquet or Arrow IPC (FORMATS); the machine-readable formats are far faster
+to write and have no row limit. Column names and order are the same in
+every format.
+
+Reports are rendered concurrently in a process pool, each straight to a
+temp file; workbooks use xlsxwriter's constant-memory mode (rows are
+streamed to disk as they're written instead of the whole sheet being held
+in memory). The ZIP is then assembled by streaming those files in. Every
+format is already compressed, so by default the files are stored in the
+bundle rather than deflated a second time.
+"""
+
+import datetime
+import math
+import numbers
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from pipeline import instrument
+
+# Rows converted to Python values at a time while streaming a sheet
+CHUNK_ROWS = 10_000
+
+# Bundles up to this size stay in memory; bigger ones spill to a temp file while being assembled
+SPOOL_BYTES = 32 * 1024 * 1024
+
+# Output format -> file extension
+FORMATS = {
+    "xlsx": ".xlsx",
+    "csv.gz": ".csv.gz",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+DEFAULT_FORMAT = "xlsx"
+FORMAT_LABELS = {
+    "xlsx": "Excel (.xlsx)",
+    "csv.gz": "Compressed CSV (.csv.gz)",
+    "parquet": "Parquet (.parquet)",
+    "arrow": "Arrow IPC (.arrow)",
+}
+
+# Rows in an Excel sheet, including the header row
+EXCEL_MAX_ROWS = 1_048_576
+
+# Same look as pandas' to_excel output
+HEADER_FORMAT = {"bold": True, "border": 1, "align": "center", "valign": "top"}
+DATE_FORMAT = "yyyy-mm-dd"
+DATETIME_FORMAT = "yyyy-mm-dd hh:mm:ss"
+
+
+def write_cell(worksheet, row, col, value, formats):
+    """Write one value the way pandas' to_excel would (missing values are left blank)."""
+    if value is None or value is pd.NaT:
+        return
+    if isinstance(value, (bool, np.bool_)):
+        worksheet.write_boolean(row, col, bool(value))
+    elif isinstance(value, numbers.Real):
+        value = float(value)
+        if math.isnan(value):
+            return
+        if math.isinf(value):
+            worksheet.write_string(row, col, "inf" if value > 0 else "-inf")
+        else:
+            worksheet.write_number(row, col, value)
+    elif isinstance(value, str):
+        if value:
+            worksheet.write_string(row, col, value)
+    elif isinstance(value, datetime.datetime):
+        worksheet.write_datetime(row, col, value, formats["datetime"])
+    elif isinstance(value, datetime.date):
+        worksheet.write_datetime(row, col, value, formats["date"])
+    else:
+        worksheet.write_string(row, col, str(value))
+
+
+def write_workbook(df, path):
+    """Write `df` to a single-sheet workbook at `path`, streaming rows in constant-memory mode."""
+    if len(df) + 1 > EXCEL_MAX_ROWS:
+        raise ValueError(f"{len(df):,} rows don't fit in an Excel sheet; choose CSV, Parquet or Arrow for this report")
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    worksheet = workbook.add_worksheet("Sheet1")
+    formats = {
+        "header": workbook.add_format(HEADER_FORMAT),
+        "date": workbook.add_format({"num_format": DATE_FORMAT}),
+        "datetime": workbook.add_format({"num_format": DATETIME_FORMAT}),
+    }
+
+    for col, name in enumerate(df.columns):
+        worksheet.write_string(0, col, str(name), formats["header"])
+
+    # Constant-memory mode only allows writing row by row, so walk the frame a chunk of rows at a time
+    for start in range(0, len(df), CHUNK_ROWS):
+        chunk = df.iloc[start:start + CHUNK_ROWS]
+        columns = [chunk.iloc[:, col].tolist() for col in range(chunk.shape[1])]
+        for offset, values in enumerate(zip(*columns)):
+            row = start + offset + 1
+            for col, value in enumerate(values):
+                write_cell(worksheet, row, col, value, formats)
+
+    workbook.close()
+    return path
+
+
+def write_report(df, path, output_format=DEFAULT_FORMAT):
+    """Write `df` to `path` in one of FORMATS, without the index."""
+    if output_format == "xlsx":
+        write_workbook(df, path)
+    elif output_format == "csv.gz":
+        df.to_csv(path, index=False, compression="gzip")
+    elif output_format == "parquet":
+        df.to_parquet(path, index=False)
+    elif output_format == "arrow":
+        # Arrow IPC file (Feather v2); it needs a default index, which isn't written
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        raise ValueError(f"Unknown output format '{output_format}'; expected one of {', '.join(FORMATS)}")
+    return path
+
+
+def timed_write(df, path, output_format=DEFAULT_FORMAT):
+    """write_report, returning how long it took (for reports written in a worker process)."""
+    started = time.perf_counter()
+    write_report(df, path, output_format)
+    return time.perf_counter() - started
+
+
+def output_name(name, output_format=DEFAULT_FORMAT):
+    """Report file name with the extension for `output_format`, e.g. ("TDM.xlsx", "parquet") -> "TDM.parquet"."""
+    return os.path.splitext(name)[0] + FORMATS[output_format]
+
+
+def render_reports(frames, directory, workers=None, recorder=None, formats=None):
+    """Write every {file name: dataframe} into `directory`, in parallel when there's more than one.
+
+    `formats` maps file names to one of FORMATS (default xlsx). Returns {file name: path}.
+    """
+    formats = {name: (formats or {}).get(name, DEFAULT_FORMAT) for name in frames}
+    paths = {name: os.path.join(directory, f"{index}{FORMATS[formats[name]]}") for index, name in enumerate(frames)}
+    workers = min(workers or os.cpu_count() or 1, len(frames))
+    if workers <= 1:
+        for name, df in frames.items():
+            with instrument.stage(recorder, f"{formats[name]} write: {name}", len(df)) as meter:
+                write_report(df, paths[name], formats[name])
+                meter.rows_out = len(df)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {name: pool.submit(timed_write, df, paths[name], formats[name]) for name, df in frames.items()}
+            for name, future in futures.items():
+                seconds = future.result()
+                if recorder is not None:
+                    recorder.add(f"{formats[name]} write: {name}", seconds, len(frames[name]), len(frames[name]))
+    return paths
+
+
+def write_bundle(frames, target, workers=None, compress=False, recorder=None, formats=None):
+    """Write {file name: dataframe} into a ZIP at `target` (a path or binary file object).
+
+    Each report is written in the format `formats` gives for its file name
+    (Excel by default) and named with that format's extension. Files are
+    stored as-is unless `compress` is set.
+    """
+    formats = formats or {}
+    with instrument.stage(recorder, "bundle", sum(len(df) for df in frames.values())):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = render_reports(frames, directory, workers, recorder, formats)
+            with instrument.stage(recorder, "zip", len(frames)):
+                with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED) as zip_file:
+                    for name in frames:
+                        zip_file.write(paths[name], arcname=output_name(name, formats.get(name, DEFAULT_FORMAT)))
+
+
+def bundle_bytes(frames, workers=None, compress=False, recorder=None, formats=None):
+    """Same as write_bundle, returning the ZIP's bytes."""
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as spool:
+        write_bundle(frames, spool, workers=workers, compress=compress, recorder=recorder, formats=formats)
+        spool.seek(0)
+        return spool.read()
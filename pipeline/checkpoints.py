@@ -0,0 +1,82 @@
+"""Stage checkpoints: Arrow snapshots of a run's intermediate frames.
+
+With a CheckpointStore, engine.process writes each intermediate frame (the
+enriched users, the trip cube and period partials, df_individual,
+df_individual_adjusted, df_loggers, the wide pivots and the finished
+reports) to <name>.arrow in the store's directory. Snapshots are Arrow IPC
+files, so they're fast to write, keep the categoricals and dtypes, and are
+read back through a memory map.
+
+A later run can then resume from any of engine.PROCESS_STAGES, loading the
+frames that stage needs instead of redoing everything before it: tweaking
+the GDOT or TDM report logic means resuming from "reports", without
+reading the exports or redoing the spatial join. Snapshots are also handy
+for inspecting a run (pd.read_feather reads them).
+"""
+
+import json
+import os
+
+import pyarrow as pa
+
+MANIFEST_FILE = "manifest.json"
+EXTENSION = ".arrow"
+
+
+class CheckpointStore:
+    """Snapshots for one run (one reporting period) in `directory`."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + EXTENSION)
+
+    def save(self, name, df):
+        """Write `df` (index included, unless it's the default one) as an Arrow IPC file; returns `df`."""
+        table = pa.Table.from_pandas(df)
+        tmp_path = f"{self.path(name)}.{os.getpid()}.tmp"
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, self.path(name))
+        return df
+
+    def load(self, name):
+        """Read a snapshot back through a memory map."""
+        if not os.path.exists(self.path(name)):
+            raise ValueError(f"No '{name}' checkpoint in {self.directory}; run the earlier stages with checkpoints first")
+        with pa.memory_map(self.path(name)) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+
+    def names(self):
+        return sorted(name[:-len(EXTENSION)] for name in os.listdir(self.directory) if name.endswith(EXTENSION))
+
+    def start(self, start, end, resume=False, export=None):
+        """Record the run's period and `export` (the (source, label) its partials are saved as), or when resuming, check
+        the snapshots are from the same period.
+
+        Returns the recorded export (None if there wasn't one), so a resumed run can save its partials without the exports.
+        """
+        path = os.path.join(self.directory, MANIFEST_FILE)
+        period = {"start": start.isoformat(), "end": end.isoformat()}
+        if resume:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                raise ValueError(f"No checkpoints to resume from in {self.directory}")
+            if {key: saved.get(key) for key in period} != period:
+                raise ValueError(f"The checkpoints in {self.directory} are for {saved.get('start')} through {saved.get('end')}, "
+                                 f"not {period['start']} through {period['end']}")
+            return tuple(saved["export"]) if saved.get("export") else None
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(period, export=list(export) if export else None), f, indent=2)
+        return export
+
+
+def save(checkpoints, name, df):
+    """checkpoints.save(name, df), or nothing when there's no store. Returns `df` either way."""
+    if checkpoints is not None:
+        checkpoints.save(name, df)
+    return df
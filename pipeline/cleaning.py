@@ -0,0 +1,90 @@
+"""Rule-based removal of junk/test records from the Users and Trips reports.
+
+The exclusions live in cleaning_rules.json at the repo root (or the file named
+by the GCO_CLEANING_RULES environment variable), so they can be updated
+without a code change:
+
+* networks: exact 'Networks' values
+* email_domains: any email containing "@<domain>"
+* emails: exact email addresses
+* employers: exact 'Employer Name' values (Users report only)
+* trip_user_names: exact 'User Name' values (Trips report only)
+
+All rules for a table are combined into one boolean mask (hashed set
+membership for the exact lists, one precompiled pattern for the domains) and
+applied with a single filter.
+"""
+
+import hashlib
+import json
+import os
+import re
+from collections import namedtuple
+
+import pandas as pd
+
+from pipeline.config import ROOT_DIR
+
+RULES_FILE = os.environ.get("GCO_CLEANING_RULES", os.path.join(ROOT_DIR, "cleaning_rules.json"))
+
+Rules = namedtuple("Rules", ["networks", "email_pattern", "emails", "employers", "trip_user_names"])
+
+# (rule, column) checked for each report, in the order removals are attributed
+USER_RULES = [("networks", "Networks"), ("email_domains", "Email"), ("emails", "Email"), ("employers", "Employer Name")]
+TRIP_RULES = [("networks", "Networks"), ("email_domains", "User Email"), ("emails", "User Email"), ("trip_user_names", "User Name")]
+
+
+def rules_version(path=RULES_FILE):
+    """Checksum of the rules file, so anything cached from cleaned data can be keyed to the rules used."""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_rules(path=RULES_FILE):
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    domains = config.get("email_domains", [])
+    return Rules(
+        networks=frozenset(config.get("networks", [])),
+        email_pattern=re.compile("|".join(re.escape("@" + domain) for domain in domains)) if domains else None,
+        emails=frozenset(config.get("emails", [])),
+        employers=frozenset(config.get("employers", [])),
+        trip_user_names=frozenset(config.get("trip_user_names", [])),
+    )
+
+
+def rule_mask(df, rule, column, rules):
+    values = df[column]
+    if rule == "email_domains":
+        if rules.email_pattern is None:
+            return pd.Series(False, index=df.index)
+        return values.fillna("").str.contains(rules.email_pattern, regex=True)
+    return values.isin(getattr(rules, rule))
+
+
+def apply_rules(df, table_rules, rules):
+    """Drop every row matching any rule in one pass.
+
+    Returns (cleaned dataframe, {rule: rows removed}). A row matching several
+    rules is counted once, under the first of them.
+    """
+    removed = pd.Series(False, index=df.index)
+    counts = {}
+    for rule, column in table_rules:
+        mask = rule_mask(df, rule, column, rules)
+        counts[rule] = int((mask & ~removed).sum())
+        removed |= mask
+    return df[~removed.to_numpy()], counts
+
+
+def clean_users(df_users, rules=None):
+    return apply_rules(df_users, USER_RULES, rules or load_rules())
+
+
+def clean_trips(df_trips, rules=None):
+    return apply_rules(df_trips, TRIP_RULES, rules or load_rules())
+
+
+def describe(counts):
+    """One-line summary of rows removed per rule."""
+    return ", ".join(f"{rule.replace('_', ' ')}: {count:,}" for rule, count in counts.items())
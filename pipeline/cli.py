@@ -0,0 +1,181 @@
+"""Command-line entry point for batch processing.
+
+Run one or more reporting periods without the browser, in parallel across a
+process pool. Each job writes the same ZIP bundle the app offers for download.
+
+A Trips export holds no trip dates, so it's taken to cover exactly its job's
+period: each Trips file may back only one job.
+
+    # One period
+    python -m pipeline.cli --users Users.xlsx --trips Trips.xlsx --period 2025-01-01 2025-01-31
+
+    # Several periods, each from its own export (or several networks' exports)
+    python -m pipeline.cli --job 2025-01-01 2025-01-31 Users.xlsx TripsJan.xlsx --job 2025-02-01 2025-02-28 Users.xlsx TripsFeb.xlsx
+
+    # Parquet for every report except the audit, which stays a workbook
+    python -m pipeline.cli --users Users.xlsx --trips Trips.xlsx --period 2025-01-01 2025-01-31 --format parquet --report-format "ESO Audit.xlsx" xlsx
+
+    # Snapshot every stage, then redo just the reports after changing the report logic
+    python -m pipeline.cli --users Users.xlsx --trips Trips.xlsx --period 2025-01-01 2025-01-31 --checkpoint-dir checkpoints
+    python -m pipeline.cli --users Users.xlsx --trips Trips.xlsx --period 2025-01-01 2025-01-31 --checkpoint-dir checkpoints --resume-from reports
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pipeline import bundle, checkpoints, engine, instrument, periods, spatial
+
+Job = namedtuple("Job", ["start", "end", "users", "trips"])
+
+
+def parse_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a YYYY-MM-DD date: {value}")
+
+
+def output_name(job):
+    return f"{job.start}_{job.end}_{os.path.splitext(os.path.basename(job.trips))[0]}.zip"
+
+
+def checkpoint_path(job, checkpoint_dir):
+    """Each job's checkpoints go in their own subdirectory of `checkpoint_dir`, named like its bundle."""
+    return os.path.join(checkpoint_dir, os.path.splitext(output_name(job))[0])
+
+
+def run_job(job, out_dir, use_cache=True, save_period=True, render_workers=None, compress=False, stream=False, formats=None,
+            spatial_workers=None, recorder=None, removed=None, checkpoint_dir=None, resume_from=None, df_users=None, df_trips=None):
+    """Process one job end to end and write its bundle and JSON run log. Runs inside a worker process.
+
+    Stages are timed into `recorder` if one is given (a fresh one otherwise).
+    When streaming, the trip records excluded by each cleaning rule are
+    counted into `removed`. With `checkpoint_dir`, every stage's frames are
+    snapshotted there, and `resume_from` picks up from an earlier run's
+    snapshots (see engine.process), skipping the exports it doesn't need.
+    Exports already read and cleaned can be passed as `df_users` and
+    `df_trips`; job.users and job.trips then only name the bundle.
+    """
+    started = time.perf_counter()
+    recorder = recorder or instrument.Recorder()
+    inputs = engine.RESUME_INPUTS[resume_from or engine.PROCESS_STAGES[0]]
+    if df_users is None and "users" in inputs:
+        with recorder.stage("load users") as meter:
+            df_users, _, _ = engine.load_users(job.users)
+            meter.rows_out = len(df_users)
+    if df_trips is None and "trips" in inputs and stream:
+        # The trips are read, cleaned and aggregated a chunk at a time inside process()
+        df_trips = engine.stream_trips(job.trips, removed)
+    elif df_trips is None and "trips" in inputs:
+        with recorder.stage("load trips") as meter:
+            df_trips, _, _ = engine.load_trips(job.trips)
+            meter.rows_out = len(df_trips)
+
+    # Partials are stored per export, so other networks' exports for the same period are kept alongside. The export is
+    # identified by hashing both files, so only when the run reads them; a resumed run uses the one in its checkpoints.
+    period_store = periods.PeriodStore() if save_period else None
+    export = periods.file_export(job.users, job.trips) if (save_period or checkpoint_dir) and "users" in inputs else None
+    checkpoint_store = checkpoints.CheckpointStore(checkpoint_path(job, checkpoint_dir)) if checkpoint_dir else None
+    result = engine.process(
+        df_users, df_trips, job.start, job.end, use_cache=use_cache, period_store=period_store, recorder=recorder, spatial_workers=spatial_workers,
+        checkpoints=checkpoint_store, resume_from=resume_from, export=export,
+    )
+
+    path = os.path.join(out_dir, output_name(job))
+    bundle.write_bundle(engine.report_frames(result.reports), path, workers=render_workers, compress=compress, recorder=recorder, formats=formats)
+    recorder.write_log(
+        period_start=job.start, period_end=job.end, users_file=job.users, trips_file=job.trips, bundle=path, formats=formats,
+        cache_hits=result.cache_hits, cache_misses=result.cache_misses,
+    )
+    return path, time.perf_counter() - started, result
+
+
+def build_jobs(args):
+    jobs = [Job(parse_date(start), parse_date(end), users, trips) for start, end, users, trips in args.job or []]
+    if args.period:
+        if not (args.users and args.trips):
+            raise SystemExit("--period needs --users and --trips")
+        if len(args.period) > 1:
+            raise SystemExit("One Trips export covers one period: give each period its own export with --job START END USERS TRIPS")
+        jobs += [Job(parse_date(start), parse_date(end), args.users, args.trips) for start, end in args.period]
+    if not jobs:
+        raise SystemExit("Nothing to do: give at least one --period or --job")
+    for job in jobs:
+        if job.end < job.start:
+            raise SystemExit(f"Period {job.start} through {job.end} ends before it starts")
+    trips = [os.path.realpath(job.trips) for job in jobs]
+    for path in set(trips):
+        if trips.count(path) > 1:
+            raise SystemExit(f"{path} is the Trips export for more than one job; each period needs its own export")
+    return jobs
+
+
+def build_formats(args):
+    """{report file name: output format} from --format and --report-format."""
+    formats = {name: args.format for name in engine.REPORT_FILES}
+    for name, output_format in args.report_format or []:
+        if name not in formats:
+            raise SystemExit(f"Unknown report '{name}'; expected one of {', '.join(engine.REPORT_FILES)}")
+        if output_format not in bundle.FORMATS:
+            raise SystemExit(f"Unknown output format '{output_format}'; expected one of {', '.join(bundle.FORMATS)}")
+        formats[name] = output_format
+    return formats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pipeline.cli", description="Process RideAmigos Users/Trips reports into the GCO report bundle.")
+    parser.add_argument("--users", help="Users report (.xlsx/.csv/.parquet) for --period")
+    parser.add_argument("--trips", help="Trips report (.xlsx/.csv/.parquet) for --period")
+    parser.add_argument("--period", nargs=2, action="append", metavar=("START", "END"), help="reporting period (YYYY-MM-DD) the --trips export covers")
+    parser.add_argument("--job", nargs=4, action="append", metavar=("START", "END", "USERS", "TRIPS"), help="period with its own exports; repeatable")
+    parser.add_argument("--out-dir", default=".", help="where to write the ZIP bundles (default: current directory)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parallel worker processes (default: CPU count)")
+    parser.add_argument("--no-cache", action="store_true", help="don't use the location cache for the spatial join")
+    parser.add_argument("--no-store", action="store_true", help="don't save the period aggregates to the period store")
+    parser.add_argument("--spatial-workers", type=int, help="processes for each job's spatial join (default: CPU count split between the jobs; 1 for serial); "
+                        f"only used above {spatial.PARALLEL_CHUNK:,} distinct uncached locations, below which the join always runs serially")
+    parser.add_argument("--stream", action="store_true", help="read the trips in chunks instead of all at once (bounded memory for very large exports)")
+    parser.add_argument("--format", default=bundle.DEFAULT_FORMAT, choices=list(bundle.FORMATS), help="output format for every report (default: xlsx)")
+    parser.add_argument("--report-format", nargs=2, action="append", metavar=("REPORT", "FORMAT"), help="output format for one report, e.g. \"TDM.xlsx\" parquet; repeatable")
+    parser.add_argument("--checkpoint-dir", help="snapshot every stage's frames (Arrow files) under this directory, one subdirectory per job")
+    parser.add_argument("--resume-from", choices=engine.PROCESS_STAGES, help="redo only this stage and the ones after it, from the snapshots in --checkpoint-dir")
+    parser.add_argument("--compress", action="store_true", help="deflate the workbooks inside the ZIP (they're already compressed, so this rarely helps)")
+    args = parser.parse_args(argv)
+
+    jobs = build_jobs(args)
+    formats = build_formats(args)
+    if args.resume_from and not args.checkpoint_dir:
+        raise SystemExit("--resume-from needs the --checkpoint-dir of an earlier run")
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    failures = 0
+    workers = max(1, min(args.workers or 1, len(jobs)))
+    # Each job runs its spatial join and renders its workbooks in parallel too; split the cores between the jobs running at once
+    render_workers = max(1, (os.cpu_count() or 1) // workers)
+    spatial_workers = args.spatial_workers or render_workers
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(run_job, job, args.out_dir, not args.no_cache, not args.no_store, render_workers, args.compress, args.stream, formats, spatial_workers,
+                        checkpoint_dir=args.checkpoint_dir, resume_from=args.resume_from): job
+            for job in jobs
+        }
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                path, seconds, result = future.result()
+            except Exception as error:
+                failures += 1
+                print(f"FAILED {job.start} through {job.end} ({job.trips}): {error}", file=sys.stderr)
+            else:
+                print(f"{job.start} through {job.end}: wrote {path} in {seconds:.1f}s "
+                      f"(location cache {result.cache_hits} hits, {result.cache_misses} misses)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
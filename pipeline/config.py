@@ -0,0 +1,17 @@
+"""Shared paths for the processing pipeline."""
+
+import os
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Boundary shapefiles shipped with the repo
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+
+# Compiled/derived artifacts that are safe to delete (rebuilt on demand)
+CACHE_DIR = os.path.join(ROOT_DIR, ".cache")
+
+# Per-run JSON logs (stage timings, memory and row counts)
+LOG_DIR = os.path.join(ROOT_DIR, "logs")
+
+# Background processing jobs: uploads, status and finished bundles (see pipeline.jobs)
+JOB_DIR = os.path.join(ROOT_DIR, "jobs")
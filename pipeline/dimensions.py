@@ -0,0 +1,88 @@
+"""Shared dimension layer for the report fields.
+
+Method, ESO, ESO Adjust State/Fed, Home ZIP and Territory are carried as
+pandas categoricals (integer codes plus one copy of each distinct label), so
+the groupbys, pivots and merges run on codes and the trip-level tables stay
+small. Each ESO is mapped once to its Territory and to the name the audit
+compares against the RideAmigos 'Tmas' field; those mappings run over the
+distinct labels only, never over every row.
+
+Categories are kept in sorted order so sorting and grouping on the codes
+gives the same order as on the original strings.
+"""
+
+import numpy as np
+import pandas as pd
+
+from pipeline.spatial import OUT_OF_REGION, UNKNOWN
+
+UNKNOWN_OUT_OF_REGION = "Unknown/Out of Region"
+STATE_FED = "GCO State/Fed"
+
+# Raw Trips report modes -> report Method names, e.g., "cww" in raw data should come out "CWW"
+METHOD_NAMES = {'bike': 'Bike', 'carpool': 'Carpool', 'cww': 'CWW', 'drive': 'Drive', 'scooter': 'Scooter', 'telework': 'Telework', 'transit': 'Transit', 'vanpool': 'Vanpool', 'walk': 'Walk'}
+
+# The ESO names that are spelled differently in the RideAmigos 'Tmas' field
+AUDIT_ALIASES = {"Midtown Transportation": "Midtown Alliance", "ASAP": "Atlantic Station (ASAP)"}
+
+
+def territory(eso_adjusted):
+    """Territory collapses Unknown and Out of Region into a single category and combines all GCO regions into one."""
+    if eso_adjusted in (UNKNOWN, OUT_OF_REGION):
+        return UNKNOWN_OUT_OF_REGION
+    if "GCO" in eso_adjusted:
+        return "GCO"
+    return eso_adjusted
+
+
+def audit_alias(eso):
+    """The ESO as it would appear in 'Tmas': no colons, Unknown/Out of Region combined, and a few renamed."""
+    eso = eso.replace(":", "")
+    if eso in (UNKNOWN, OUT_OF_REGION):
+        return UNKNOWN_OUT_OF_REGION
+    return AUDIT_ALIASES.get(eso, eso)
+
+
+def method_name(mode):
+    return METHOD_NAMES.get(mode, mode)
+
+
+def encode(values):
+    """Categorical with sorted categories. Values that are already categorical are just re-sorted."""
+    values = pd.Series(values, copy=False)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.reorder_categories(values.cat.categories.sort_values())
+    return values.astype("category")
+
+
+def remap(values, mapping):
+    """Apply `mapping` (label -> label) to a categorical Series by mapping its categories once and remapping the codes."""
+    values = encode(values)
+    mapped = pd.Index([mapping(label) for label in values.cat.categories], dtype=object)
+    categories = mapped.unique().sort_values()
+    lookup = categories.get_indexer(mapped)
+    codes = values.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, lookup[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=values.index, name=values.name)
+
+
+def adjust_state_fed(eso, state_fed):
+    """'ESO Adjust State/Fed': the ESO, or "GCO State/Fed" wherever 'State/Fed' has any value."""
+    eso = encode(eso)
+    if STATE_FED not in eso.cat.categories:
+        eso = eso.cat.add_categories([STATE_FED])
+    adjusted = eso.mask(state_fed.notna() & (state_fed != ''), STATE_FED)
+    return encode(adjusted.cat.remove_unused_categories())
+
+
+def to_territory(eso_adjusted):
+    return remap(eso_adjusted, territory)
+
+
+def to_audit_alias(eso):
+    return remap(eso, audit_alias)
+
+
+def to_method(modes):
+    return remap(modes, method_name)
+
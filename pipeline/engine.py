@@ -0,0 +1,288 @@
+"""Headless processing engine: clean -> enrich -> aggregate -> report.
+
+Everything the PROCESS RECORDS button does, importable without Streamlit so it
+can be scripted or run from the command line (see pipeline.cli).
+"""
+
+from collections import namedtuple
+
+import pandas as pd
+
+from pipeline import checkpoints as checkpoint, cleaning, dimensions, ingest, instrument, periods, reports, spatial
+from pipeline.boundaries import load_boundaries
+from pipeline.geocache import GeoCache
+
+REPORT_FILES = ["Tableau.xlsx", "GDOT Report.xlsx", "TDM.xlsx", "ESO Audit.xlsx"]
+
+Reports = namedtuple("Reports", ["tableau", "gdot", "tdm", "audit"])
+
+# Result of a full run: the reports plus the location cache counters for the spatial step
+RunResult = namedtuple("RunResult", ["reports", "cache_hits", "cache_misses"])
+
+# Top-level stages of process(), in order (each has nested stages; see pipeline.instrument)
+PROCESS_STAGES = ["spatial enrichment", "new users", "aggregate", "save period", "reports"]
+
+# Raw inputs process() still reads when resuming from each stage (the rest comes from the stage checkpoints)
+RESUME_INPUTS = {
+    "spatial enrichment": ("users", "trips"),
+    "new users": ("trips",),
+    "aggregate": ("trips",),
+    "save period": (),
+    "reports": (),
+}
+
+# Trips report metric columns, in the order of reports.METRICS once renamed
+TRIP_METRICS = ['Trips', 'Miles', 'Vehicle Miles Reduced', 'CO2 Savings (grams)', 'Dollars Savings']
+
+
+def load_users(source, rules=None):
+    """Read and clean a Users report. Returns (df_users, ingest.LoadStats, {cleaning rule: rows removed})."""
+    df_users, load_stats = ingest.read_users(source)
+    # Get rid of junk/test records in user file (see cleaning_rules.json)
+    df_users, removed = cleaning.clean_users(df_users, rules)
+    return df_users, load_stats, removed
+
+
+def load_trips(source, rules=None):
+    """Read and clean a Trips report. Returns (df_trips, ingest.LoadStats, {cleaning rule: rows removed})."""
+    df_trips, load_stats = ingest.read_trips(source)
+    # Get rid of junk/test records from trips file (see cleaning_rules.json)
+    df_trips, removed = cleaning.clean_trips(df_trips, rules)
+    return df_trips, load_stats, removed
+
+
+def stream_trips(source, removed=None, chunk_rows=ingest.CHUNK_ROWS, rules=None):
+    """Read and clean a Trips report `chunk_rows` rows at a time, for process() in bounded memory.
+
+    Yields cleaned chunks. Rows removed per cleaning rule are added up in `removed` (a dict) as the chunks go by.
+    """
+    rules = rules or cleaning.load_rules()
+    for chunk in ingest.iter_trips(source, chunk_rows):
+        chunk, counts = cleaning.clean_trips(chunk, rules)
+        if removed is not None:
+            for rule, count in counts.items():
+                removed[rule] = removed.get(rule, 0) + count
+        yield chunk
+
+
+def enrich_users(df_users, boundaries=None, cache=None, recorder=None, workers=None):
+    """Add the spatial fields and 'ESO Adjust State/Fed' to a cleaned users table (returns a new dataframe)."""
+
+    # The User ID is called "_id" in the Users table but "User ID" in the trip log, so we adjust the name in the users dataframe to match for joining purposes.
+    df_users = df_users.rename(columns={'_id': 'User ID'})
+
+    # The ESO, ZCTA and Counties boundaries are compiled once from the shapefiles in data/ (already in the right coordinate
+    # reference system) and shared across runs, each with a grid index that answers most points without geometry math;
+    # they're recompiled automatically if a shapefile changes.
+    if boundaries is None:
+        boundaries = load_boundaries()
+
+    # Split home/work coordinates into longitude and latitude and spatially join them to ESO, ZCTA and Counties in one pass.
+    # (Note: we're determining Home ESO in order to check whether a home address is within region)
+    # Missing data is already handled: if lat/lon exists but the ESO spatial join is empty, every field is coded as "Out of Region";
+    # if lat/lon is null, every field is coded as "Unknown".
+    for column, values in spatial.enrich_users(df_users, boundaries.eso, boundaries.zip, boundaries.county, cache=cache, recorder=recorder, grids=boundaries.grids, workers=workers).items():
+        df_users[column] = values
+
+    # ESO and Home ZIP are report dimensions: carry them as categorical codes (see pipeline.dimensions)
+    df_users['ESO'] = dimensions.encode(df_users['ESO'])
+    df_users['Home ZIP'] = dimensions.encode(df_users['Home ZIP'])
+
+    # The GDOT report needs certain records marked as "GCO/State Fed".
+    # Add a new field containing the same value as 'ESO' if 'State/Fed' is blank, and "GCO State/Fed" if 'State/Fed' contains any value.
+    df_users['ESO Adjust State/Fed'] = dimensions.adjust_state_fed(df_users['ESO'], df_users['State/Fed'])
+    return df_users
+
+
+def flag_new_users(df_users, startDate, endDate):
+    """Add the 'New Users' dummy: 1 if the account was created within the reporting period."""
+    # First create datetime, then convert to date, then make comparison to the date range.
+    # df_users['Registration Date'] = pd.to_datetime(df_users['Created'], format='%m/%d/%Y')
+    df_users = df_users.copy()
+    df_users['Registration Date'] = pd.to_datetime(df_users['Created'], format='%m/%d/%y %I:%M %p')
+    df_users['Registration Date'] = df_users['Registration Date'].dt.date
+    df_users['New Users'] = ((df_users['Registration Date'] >= startDate) & (df_users['Registration Date'] <= endDate)).astype(int)
+    return df_users
+
+
+def build_cube(df_trips, df_users, recorder=None):
+    """Collapse the trips to the finest grain any report needs, in one pass over the trip log.
+
+    Returns one row per User ID x Method x ESO x ESO Adjust State/Fed x Home ZIP with the summed metrics and the
+    number of trips logged ('Logs'). Every Tableau/GDOT/TDM rollup is derived from this much smaller table.
+    """
+
+    # Sum the raw trips per user and mode first; everything after this works on one row per user x mode instead of per trip.
+    # Missing keys are kept (dropna=False) so the log counts by Territory still include trips whose user has no Home ZIP.
+    with instrument.stage(recorder, "groupby User ID x Mode", len(df_trips)) as meter:
+        grouped = df_trips.groupby(['User ID', 'Mode'], dropna=False, sort=False, observed=True)
+        df_cube = grouped[TRIP_METRICS].sum()
+        df_cube['Logs'] = grouped.size()
+        df_cube = df_cube.reset_index()
+        meter.rows_out = len(df_cube)
+
+    # Add fields present in the Users Dataframe: "ESO", "Home ZIP", and "ESO Adjust State/Fed".
+    with instrument.stage(recorder, "trips merge", len(df_cube)) as meter:
+        df_cube = df_cube.merge(df_users[['User ID', 'ESO', 'Home ZIP', 'ESO Adjust State/Fed']], on='User ID', how='left')
+        meter.rows_out = len(df_cube)
+
+    # Rename column names to match desired output
+    df_cube = df_cube.rename(columns={'Mode': 'Method', 'CO2 Savings (grams)': 'CO2', 'Dollars Savings': 'Dollars', 'Vehicle Miles Reduced': 'VMR'})
+
+    # Change the Method values to match desired output, e.g., "cww" in raw data should come out "CWW"
+    df_cube['Method'] = dimensions.to_method(df_cube['Method'])
+
+    # Re-collapse in case two raw modes map to the same Method (or a User ID appears twice in the users file)
+    with instrument.stage(recorder, "groupby cube", len(df_cube)) as meter:
+        df_cube = df_cube.groupby(periods.INDIVIDUAL_KEYS, as_index=False, dropna=False, observed=True)[reports.METRICS + ['Logs']].sum()
+        meter.rows_out = len(df_cube)
+    return df_cube
+
+
+def fold_cubes(df_cube, df_chunk_cube):
+    """Add one chunk's cube into the running cube."""
+    if df_cube is None:
+        return df_chunk_cube
+    df_cube = pd.concat([df_cube, df_chunk_cube], ignore_index=True)
+    # Each chunk's Mode column has its own categories, so the concatenated Method may have fallen back to plain strings
+    df_cube['Method'] = dimensions.encode(df_cube['Method'])
+    return df_cube.groupby(periods.INDIVIDUAL_KEYS, as_index=False, dropna=False, observed=True)[reports.METRICS + ['Logs']].sum()
+
+
+def aggregate(df_trips, df_users, recorder=None, meter=None, checkpoints=None):
+    """Collapse the cleaned trips and enriched users to this period's partial aggregates (see pipeline.periods).
+
+    `df_trips` is either a dataframe or an iterable of dataframes (see stream_trips). Chunks are folded into a running
+    cube one at a time, so memory depends on the number of users and dimensions rather than the number of trips.
+    """
+    if isinstance(df_trips, pd.DataFrame):
+        df_cube, rows = build_cube(df_trips, df_users, recorder), len(df_trips)
+    else:
+        # One stage per chunk (reading and cleaning a chunk happen in stream_trips, inside the enclosing stage)
+        df_cube, rows = None, 0
+        for index, df_chunk in enumerate(df_trips, 1):
+            with instrument.stage(recorder, f"fold trips chunk {index}", len(df_chunk)) as chunk_meter:
+                df_cube = fold_cubes(df_cube, build_cube(df_chunk, df_users))
+                chunk_meter.rows_out = len(df_cube)
+            rows += len(df_chunk)
+    if df_cube is None:
+        df_cube = build_cube(pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in ingest.TRIP_COLUMNS.items()}), df_users)
+    if meter is not None:
+        meter.rows_in = rows
+    checkpoint.save(checkpoints, "cube", df_cube)
+    return periods.period_partials(df_cube, df_users, recorder)
+
+
+def report(df_users, partials, startDate, recorder=None, checkpoints=None):
+    """Build all four reports from the enriched users and the period's partials."""
+    # df_individual and df_individual_adjusted (ESO adjusted for State/Fed) each have one record per person x Method
+    df_individual, df_individual_adjusted = reports.individual_tables(partials.individual, recorder)
+    checkpoint.save(checkpoints, "df_individual", df_individual)
+    checkpoint.save(checkpoints, "df_individual_adjusted", df_individual_adjusted)
+
+    with instrument.stage(recorder, "Tableau report", len(df_individual)) as meter:
+        df_tableau = reports.tableau_report(df_individual, startDate, recorder)
+        meter.rows_out = len(df_tableau)
+    with instrument.stage(recorder, "GDOT report", len(df_individual_adjusted)) as meter:
+        df_gdot = reports.gdot_report(df_individual_adjusted, partials.territory_logs, partials.new_users, recorder, checkpoints)
+        meter.rows_out = len(df_gdot)
+    with instrument.stage(recorder, "TDM report", len(df_users)) as meter:
+        df_tdm = reports.tdm_report(df_users, df_individual, startDate, recorder, checkpoints)
+        meter.rows_out = len(df_tdm)
+    with instrument.stage(recorder, "ESO audit", len(df_users)) as meter:
+        df_audit = reports.audit_report(df_users)
+        meter.rows_out = len(df_audit)
+
+    run_reports = Reports(tableau=df_tableau, gdot=df_gdot, tdm=df_tdm, audit=df_audit)
+    for name, df in run_reports._asdict().items():
+        checkpoint.save(checkpoints, name, df)
+    return run_reports
+
+
+def load_checkpoint(checkpoints, name, recorder=None):
+    with instrument.stage(recorder, f"load checkpoint: {name}") as meter:
+        df = checkpoints.load(name)
+        meter.rows_out = len(df)
+    return df
+
+
+def process(df_users, df_trips, startDate, endDate, boundaries=None, use_cache=True, period_store=None, recorder=None, spatial_workers=None,
+            checkpoints=None, resume_from=None, export=None):
+    """Run the whole pipeline on cleaned users and trips for one reporting period.
+
+    `df_trips` may be a dataframe or an iterable of cleaned chunks (see stream_trips).
+
+    Coordinates are looked up in the location cache unless `use_cache` is
+    False. The period's partials are saved to `period_store` (a
+    periods.PeriodStore) when one is given, as coming from `export` (a
+    periods.Export naming the Users and Trips files). Each stage is timed into
+    `recorder` (a pipeline.instrument.Recorder) when one is given. The
+    spatial join runs in up to `spatial_workers` processes (default: CPU
+    count; 1 for serial).
+
+    With `checkpoints` (a pipeline.checkpoints.CheckpointStore), every
+    intermediate frame is snapshotted as it's built. `resume_from` (one of
+    PROCESS_STAGES) skips the stages before it, loading their output from
+    `checkpoints` instead; only the raw inputs in RESUME_INPUTS[resume_from]
+    are used (pass None for the others). When resuming, the partials are
+    saved as coming from the export recorded with the checkpoints, unless
+    `export` is given.
+    """
+    if resume_from is not None:
+        if resume_from not in PROCESS_STAGES:
+            raise ValueError(f"Can't resume from '{resume_from}'; expected one of {', '.join(PROCESS_STAGES)}")
+        if checkpoints is None:
+            raise ValueError("Resuming needs the checkpoints of an earlier run")
+    skipped = PROCESS_STAGES[:PROCESS_STAGES.index(resume_from)] if resume_from else []
+    if checkpoints is not None:
+        recorded = checkpoints.start(startDate, endDate, resume=bool(skipped), export=export)
+        if export is None and recorded is not None:
+            export = periods.Export(*recorded)
+
+    if "spatial enrichment" in skipped:
+        cache = None
+    else:
+        if boundaries is None:
+            boundaries = load_boundaries()
+        cache = GeoCache(boundaries.version) if use_cache else None
+        with instrument.stage(recorder, "spatial enrichment", len(df_users)) as meter:
+            df_users = enrich_users(df_users, boundaries, cache=cache, recorder=recorder, workers=spatial_workers)
+            meter.rows_out = len(df_users)
+        checkpoint.save(checkpoints, "enriched_users", df_users)
+
+    if "new users" in skipped:
+        df_users = load_checkpoint(checkpoints, "users", recorder)
+    else:
+        if "spatial enrichment" in skipped:
+            df_users = load_checkpoint(checkpoints, "enriched_users", recorder)
+        with instrument.stage(recorder, "new users", len(df_users)) as meter:
+            df_users = flag_new_users(df_users, startDate, endDate)
+            meter.rows_out = int(df_users['New Users'].sum())
+        checkpoint.save(checkpoints, "users", df_users)
+
+    if "aggregate" in skipped:
+        partials = periods.PeriodPartials(*(load_checkpoint(checkpoints, name, recorder) for name in periods.PeriodPartials._fields))
+    else:
+        with instrument.stage(recorder, "aggregate") as meter:
+            partials = aggregate(df_trips, df_users, recorder, meter, checkpoints)
+            meter.rows_out = len(partials.individual)
+        for name, df in partials._asdict().items():
+            checkpoint.save(checkpoints, name, df)
+
+    if "save period" not in skipped:
+        with instrument.stage(recorder, "save period"):
+            if period_store is not None:
+                period_store.save(startDate, endDate, partials, export)
+    with instrument.stage(recorder, "reports"):
+        run_reports = report(df_users, partials, startDate, recorder, checkpoints)
+
+    return RunResult(
+        reports=run_reports,
+        cache_hits=cache.hits if cache else 0,
+        cache_misses=cache.misses if cache else 0,
+    )
+
+
+def report_frames(run_reports):
+    """{file name: dataframe} for the bundle."""
+    return dict(zip(REPORT_FILES, run_reports))
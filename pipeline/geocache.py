@@ -0,0 +1,118 @@
+"""Persistent coordinate -> geography lookup cache.
+
+Most users keep the same home and work coordinates from one monthly run to
+the next, so the ESO/ZCTA/county found for a coordinate is saved in a local
+SQLite database and reused. Entries are keyed by the coordinate rounded to
+PRECISION decimal places and by the boundary store version, so recompiling
+the boundaries (see pipeline.boundaries) invalidates everything cached from
+the old data.
+
+Only the coordinates being looked up are read from the database, so a
+lookup costs the same however large the cache has grown, and entries no
+run has looked up for MAX_AGE_DAYS (users who moved or left) are dropped.
+"""
+
+import datetime
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from pipeline.config import CACHE_DIR
+
+DB_FILE = "geocache.sqlite"
+
+# Decimal places kept in the cache key (6 places is roughly 0.1 m)
+PRECISION = 6
+
+COLUMNS = ["eso", "zip", "county_name", "county_fips"]
+
+# Entries not looked up or stored for this many days are deleted
+MAX_AGE_DAYS = 180
+
+
+def coordinate_keys(lon, lat):
+    scale = 10 ** PRECISION
+    return np.round(lon * scale).astype(np.int64), np.round(lat * scale).astype(np.int64)
+
+
+class GeoCache:
+    """Lookup cache for one boundary version, with hit/miss counters for the current run."""
+
+    def __init__(self, version, path=None):
+        self.version = version
+        self.path = path or os.path.join(CACHE_DIR, DB_FILE)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.today = datetime.date.today().isoformat()
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                "version TEXT, lon_key INTEGER, lat_key INTEGER, "
+                "eso TEXT, zip TEXT, county_name TEXT, county_fips TEXT, last_seen TEXT, "
+                "PRIMARY KEY (version, lon_key, lat_key))"
+            )
+            if "last_seen" not in [row[1] for row in conn.execute("PRAGMA table_info(geocode)")]:
+                # Caches written before entries were aged: start their clock now
+                conn.execute("ALTER TABLE geocode ADD COLUMN last_seen TEXT")
+                conn.execute("UPDATE geocode SET last_seen = ?", (self.today,))
+            # Entries from older boundary data can never be hit again
+            conn.execute("DELETE FROM geocode WHERE version != ?", (version,))
+            cutoff = (datetime.date.today() - datetime.timedelta(days=MAX_AGE_DAYS)).isoformat()
+            conn.execute("DELETE FROM geocode WHERE last_seen < ?", (cutoff,))
+
+    @contextmanager
+    def connect(self):
+        # A connection per call: Streamlit serves each session from its own thread
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, lon, lat):
+        """Return (found mask, dict of cached columns) for the given coordinates."""
+        lon_key, lat_key = coordinate_keys(lon, lat)
+        wanted = pd.DataFrame({"lon_key": lon_key, "lat_key": lat_key})
+        with self.connect() as conn:
+            # The wanted keys go in a temporary table, joined on the primary key, so only they are read
+            conn.execute("CREATE TEMP TABLE wanted (lon_key INTEGER, lat_key INTEGER)")
+            keys = wanted.drop_duplicates()
+            conn.executemany("INSERT INTO wanted VALUES (?, ?)", zip(keys["lon_key"].tolist(), keys["lat_key"].tolist()))
+            cached = pd.read_sql_query(
+                "SELECT g.lon_key, g.lat_key, eso, zip, county_name, county_fips FROM wanted w "
+                "JOIN geocode g ON g.version = ? AND g.lon_key = w.lon_key AND g.lat_key = w.lat_key",
+                conn,
+                params=(self.version,),
+            )
+            # Entries still being looked up aren't aged out
+            conn.execute(
+                "UPDATE geocode SET last_seen = ? WHERE version = ? AND last_seen < ? AND (lon_key, lat_key) IN (SELECT lon_key, lat_key FROM wanted)",
+                (self.today, self.version, self.today),
+            )
+        matched = wanted.merge(cached, on=["lon_key", "lat_key"], how="left", indicator=True)
+        found = (matched["_merge"] == "both").to_numpy()
+        self.hits += int(found.sum())
+        self.misses += int((~found).sum())
+        # NULL comes back as None (outside every polygon), same as a fresh lookup
+        columns = {key: matched[key].astype(object).where(matched[key].notna(), None).to_numpy() for key in COLUMNS}
+        return found, columns
+
+    def store(self, lon, lat, columns):
+        """Save freshly classified coordinates."""
+        if len(lon) == 0:
+            return
+        lon_key, lat_key = coordinate_keys(lon, lat)
+        rows = pd.DataFrame({"lon_key": lon_key, "lat_key": lat_key, **{key: columns[key] for key in COLUMNS}})
+        rows = rows.drop_duplicates(subset=["lon_key", "lat_key"])
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO geocode (version, lon_key, lat_key, eso, zip, county_name, county_fips, last_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(self.version, int(row[0]), int(row[1]), *row[2:], self.today) for row in rows.itertuples(index=False)],
+            )
@@ -0,0 +1,138 @@
+"""Multi-resolution grid index for point-in-polygon lookups.
+
+A boundary layer's extent is split into a coarse grid of square cells, and
+each cell is refined as a quadtree: a cell whose box lies strictly inside a
+single polygon (and touches no other) is resolved to that polygon, a cell
+touching no polygon is resolved to "outside", and any other cell is split
+into four until MAX_DEPTH. Cells still unresolved at MAX_DEPTH straddle a
+boundary (or overlapping polygons), and points in them are the only ones
+that need an exact geometric test.
+
+Looking a point up is pure array arithmetic: its cell at the finest level
+is computed once, and the quadtree is walked by shifting that cell index.
+Most users sit well inside a ZCTA, county or ESO, so most points resolve
+without touching the polygons at all.
+
+Cell boxes are grown by a small margin before being tested, so a point
+whose computed cell is off by rounding still gets the same answer as the
+exact test; the index never resolves a point the exact test would place
+differently.
+"""
+
+import numpy as np
+import shapely
+
+# Coarse cells across the longer side of the layer's extent
+BASE_CELLS = 64
+
+# Quadtree levels below the coarse grid (the finest cells are 1/2**MAX_DEPTH of a coarse cell)
+MAX_DEPTH = 6
+
+# Cells are grown by this fraction of their size before being tested against the polygons
+MARGIN = 1e-6
+
+# Node values other than a polygon position
+OUTSIDE = -1
+BOUNDARY = -2
+SPLIT = -3
+
+
+class GridIndex:
+    """Quadtree of cells over one layer. `lookup` gives the containing polygon's position, OUTSIDE or BOUNDARY per point."""
+
+    def __init__(self, bounds, cell, shape, max_depth, values, children):
+        self.bounds = bounds
+        self.cell = cell
+        self.shape = shape
+        self.max_depth = max_depth
+        self.values = values
+        self.children = children
+
+    @classmethod
+    def build(cls, geometries, base_cells=BASE_CELLS, max_depth=MAX_DEPTH):
+        """Index the polygons in `geometries` (an array of shapely geometries, in layer order)."""
+        geometries = np.asarray(geometries, dtype=object)
+        tree = shapely.STRtree(geometries)
+        shapely.prepare(geometries)
+        bounds = tuple(float(v) for v in shapely.total_bounds(geometries))
+        minx, miny, maxx, maxy = bounds
+        cell = max(maxx - minx, maxy - miny) / base_cells or 1.0
+        shape = (max(int(np.ceil((maxy - miny) / cell)), 1), max(int(np.ceil((maxx - minx) / cell)), 1))
+
+        # The coarse cells are nodes 0..ny*nx-1, row by row; each split adds its four children at the end
+        iy, ix = (a.ravel() for a in np.indices(shape))
+        nodes = np.arange(ix.size)
+        values = [np.full(ix.size, SPLIT, dtype=np.int32)]
+        children = [np.full(ix.size, -1, dtype=np.int32)]
+        size = ix.size
+
+        for depth in range(max_depth + 1):
+            step = cell / 2**depth
+            margin = step * MARGIN
+            boxes = shapely.box(minx + ix * step - margin, miny + iy * step - margin, minx + (ix + 1) * step + margin, miny + (iy + 1) * step + margin)
+            # Bounding-box candidates, then the exact test with the (prepared) polygon first
+            box_idx, poly_idx = tree.query(boxes)
+            touching = shapely.intersects(geometries[poly_idx], boxes[box_idx])
+            box_idx, poly_idx = box_idx[touching], poly_idx[touching]
+            hits = np.bincount(box_idx, minlength=len(boxes))
+
+            resolved = np.full(len(boxes), SPLIT, dtype=np.int32)
+            resolved[hits == 0] = OUTSIDE
+            # A box touching exactly one polygon is resolved if that polygon contains all of it
+            single = np.flatnonzero(hits == 1)
+            first = np.searchsorted(box_idx, single)
+            inside = shapely.contains_properly(geometries[poly_idx[first]], boxes[single])
+            resolved[single[inside]] = poly_idx[first][inside]
+
+            split = np.flatnonzero(resolved == SPLIT)
+            if depth == max_depth:
+                resolved[split] = BOUNDARY
+                split = split[:0]
+            flat_values = np.concatenate(values)
+            flat_values[nodes] = resolved
+            flat_children = np.concatenate(children)
+            flat_children[nodes[split]] = size + 4 * np.arange(len(split), dtype=np.int32)
+            values, children = [flat_values], [flat_children]
+            if not len(split):
+                break
+
+            # Children in quadrant order (x bit, then y bit), matching `lookup`
+            dx, dy = np.array([0, 1, 0, 1]), np.array([0, 0, 1, 1])
+            ix = (2 * ix[split][:, None] + dx).ravel()
+            iy = (2 * iy[split][:, None] + dy).ravel()
+            nodes = size + np.arange(ix.size)
+            values.append(np.full(ix.size, SPLIT, dtype=np.int32))
+            children.append(np.full(ix.size, -1, dtype=np.int32))
+            size += ix.size
+
+        return cls(bounds, cell, shape, max_depth, np.concatenate(values), np.concatenate(children))
+
+    def lookup(self, x, y):
+        """Polygon position containing each point, OUTSIDE, or BOUNDARY where only the exact test can tell. NaN is OUTSIDE."""
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        minx, miny, maxx, maxy = self.bounds
+        result = np.full(len(x), OUTSIDE, dtype=np.int32)
+        within = np.flatnonzero((x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy))
+        if not len(within):
+            return result
+
+        # Cell at the finest level; the cell at any coarser level is this shifted right
+        ny, nx = self.shape
+        scale = 2**self.max_depth
+        fx = np.clip(np.floor((x[within] - minx) / self.cell * scale).astype(np.int64), 0, nx * scale - 1)
+        fy = np.clip(np.floor((y[within] - miny) / self.cell * scale).astype(np.int64), 0, ny * scale - 1)
+
+        node = (fy >> self.max_depth) * nx + (fx >> self.max_depth)
+        value = self.values[node]
+        # Walk down only the points still in split cells
+        active = np.flatnonzero(value == SPLIT)
+        for shift in range(self.max_depth - 1, -1, -1):
+            if not len(active):
+                break
+            quadrant = ((fx[active] >> shift) & 1) + 2 * ((fy[active] >> shift) & 1)
+            node[active] = self.children[node[active]] + quadrant
+            value[active] = found = self.values[node[active]]
+            active = active[found == SPLIT]
+        result[within] = value
+        return result
@@ -0,0 +1,183 @@
+"""Column-pruned loading of the RideAmigos Users and Trips reports.
+
+Only the columns the pipeline actually uses are parsed, with explicit dtypes.
+Reports can be .xlsx (read with the calamine engine when python-calamine is
+installed, otherwise openpyxl in read-only mode), .csv or .parquet. Large
+reports can also be streamed in chunks (iter_report).
+"""
+
+import importlib.util
+import os
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+# Columns read from the Users report. None means "let the reader infer": 'Created' may
+# come through as text or as an Excel date, and 'Active Account' as a number or a boolean.
+USER_COLUMNS = {
+    "_id": str,
+    "Networks": str,
+    "Email": str,
+    "Employer Name": str,
+    "First Name": str,
+    "Last Name": str,
+    "Work Location": str,
+    "Home Location Coords": str,
+    "Work Location Coords": str,
+    "State/Fed": str,
+    "Created": None,
+    "Active Account": None,
+    "Legacyid": str,
+    "Tmas": str,
+}
+
+# Columns read from the Trips report
+TRIP_COLUMNS = {
+    "User ID": str,
+    "Networks": str,
+    "User Email": str,
+    "User Name": str,
+    "Mode": "category",
+    "Trips": "float64",
+    "Miles": "float64",
+    "Vehicle Miles Reduced": "float64",
+    "CO2 Savings (grams)": "float64",
+    "Dollars Savings": "float64",
+}
+
+FILE_TYPES = ["xlsx", "csv", "parquet"]
+
+LoadStats = namedtuple("LoadStats", ["name", "rows", "seconds"])
+
+# Rows per chunk when a report is streamed instead of loaded whole
+CHUNK_ROWS = 50_000
+
+
+def rows_per_second(stats):
+    return stats.rows / stats.seconds if stats.seconds > 0 else float("inf")
+
+
+def excel_engine():
+    return "calamine" if importlib.util.find_spec("python_calamine") is not None else "openpyxl"
+
+
+def file_name(source):
+    """Uploaded files (Streamlit UploadedFile) carry a .name; plain paths are used as-is."""
+    return getattr(source, "name", None) or os.fspath(source)
+
+
+def apply_dtypes(df, dtypes):
+    """Cast columns the way read_excel/read_csv would with dtype=`dtypes` (for readers without a dtype option)."""
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        if dtype is str:
+            # Match read_excel/read_csv: values become text but missing values stay missing
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def read_parquet(source, wanted, dtypes):
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(source)
+    present = [column for column in parquet_file.schema_arrow.names if column in wanted]
+    return apply_dtypes(parquet_file.read(columns=present).to_pandas(), dtypes)
+
+
+def iter_xlsx(source, wanted, chunk_rows):
+    """Stream the first sheet of a workbook as dataframes of up to `chunk_rows` rows (openpyxl read-only mode)."""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        keep = [(index, name) for index, name in enumerate(header) if name in wanted]
+        names = [name for _, name in keep]
+        chunk = []
+        for row in rows:
+            chunk.append([row[index] if index < len(row) else None for index, _ in keep])
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns=names)
+                chunk = []
+        if chunk or not names:
+            yield pd.DataFrame(chunk, columns=names)
+    finally:
+        workbook.close()
+
+
+def iter_parquet(source, wanted, chunk_rows):
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(source)
+    present = [column for column in parquet_file.schema_arrow.names if column in wanted]
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=present):
+        yield batch.to_pandas()
+
+
+def read_report(source, columns):
+    """Read `columns` (name -> dtype) from an .xlsx/.csv/.parquet report.
+
+    Columns missing from the file are an error; extra columns are never parsed.
+    Returns (dataframe, LoadStats).
+    """
+    name = file_name(source)
+    extension = os.path.splitext(name)[1].lower().lstrip(".")
+    dtypes = {column: dtype for column, dtype in columns.items() if dtype is not None}
+    wanted = set(columns)
+
+    start = time.perf_counter()
+    if extension == "xlsx":
+        df = pd.read_excel(source, engine=excel_engine(), usecols=lambda c: c in wanted, dtype=dtypes)
+    elif extension == "csv":
+        df = pd.read_csv(source, usecols=lambda c: c in wanted, dtype=dtypes)
+    elif extension == "parquet":
+        df = read_parquet(source, wanted, dtypes)
+    else:
+        raise ValueError(f"Unsupported report type '{extension}' for {name}; expected one of {', '.join(FILE_TYPES)}")
+    seconds = time.perf_counter() - start
+
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise ValueError(f"{name} is missing required columns: {', '.join(missing)}")
+
+    return df[list(columns)], LoadStats(name, len(df), seconds)
+
+
+def iter_report(source, columns, chunk_rows=CHUNK_ROWS):
+    """Like read_report, but yields the report `chunk_rows` rows at a time so it never has to fit in memory whole."""
+    name = file_name(source)
+    extension = os.path.splitext(name)[1].lower().lstrip(".")
+    dtypes = {column: dtype for column, dtype in columns.items() if dtype is not None}
+    wanted = set(columns)
+
+    if extension == "xlsx":
+        chunks = (apply_dtypes(chunk, dtypes) for chunk in iter_xlsx(source, wanted, chunk_rows))
+    elif extension == "csv":
+        chunks = pd.read_csv(source, usecols=lambda c: c in wanted, dtype=dtypes, chunksize=chunk_rows)
+    elif extension == "parquet":
+        chunks = (apply_dtypes(chunk, dtypes) for chunk in iter_parquet(source, wanted, chunk_rows))
+    else:
+        raise ValueError(f"Unsupported report type '{extension}' for {name}; expected one of {', '.join(FILE_TYPES)}")
+
+    for chunk in chunks:
+        missing = [column for column in columns if column not in chunk.columns]
+        if missing:
+            raise ValueError(f"{name} is missing required columns: {', '.join(missing)}")
+        yield chunk[list(columns)]
+
+
+def read_users(source):
+    return read_report(source, USER_COLUMNS)
+
+
+def read_trips(source):
+    return read_report(source, TRIP_COLUMNS)
+
+
+def iter_trips(source, chunk_rows=CHUNK_ROWS):
+    return iter_report(source, TRIP_COLUMNS, chunk_rows)
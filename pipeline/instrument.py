@@ -0,0 +1,170 @@
+"""Per-stage instrumentation: wall time, peak memory and row counts.
+
+Pipeline functions take an optional `recorder` and wrap each step in a
+stage. The `rows_out` of the yielded meter is set once the step's output
+exists:
+
+    with instrument.stage(recorder, "trips merge", len(df_trips)) as meter:
+        df = df_trips.merge(...)
+        meter.rows_out = len(df)
+
+Without a recorder this costs nothing beyond the context manager. Stages
+nest (a report's groupbys inside the report); each record keeps its depth.
+
+Peak memory is the process's peak resident set size while the stage ran,
+sampled from /proc/self/statm by a background thread, so it includes what
+GEOS, pyarrow and xlsxwriter allocate outside Python. It is None where
+/proc isn't available, and for work done in other processes (workbooks
+rendered in parallel report their time only).
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pandas as pd
+
+from pipeline.config import LOG_DIR
+
+# How often the resident set size is sampled while a stage is open
+SAMPLE_SECONDS = 0.01
+
+STATM = "/proc/self/statm"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+Stage = namedtuple("Stage", ["name", "depth", "seconds", "peak_mb", "rows_in", "rows_out"])
+
+
+def resident_bytes():
+    """Current resident set size of this process, or None if unknown."""
+    try:
+        with open(STATM) as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Meter:
+    """Handed to the body of a stage so it can report its output rows (and its input rows, if only known afterwards)."""
+
+    def __init__(self, rows_in=None):
+        self.rows_in = rows_in
+        self.rows_out = None
+
+
+class Recorder:
+    """Collects Stage records for one run.
+
+    `on_start(name, depth)` and `on_finish(stage)` are called as stages open
+    and close (for a progress indicator).
+    """
+
+    def __init__(self, on_start=None, on_finish=None):
+        self.on_start = on_start
+        self.on_finish = on_finish
+        self.stages = []
+        self.depth = 0
+        self.started = datetime.datetime.now()
+        self._peaks = {}  # open stage index -> [peak resident bytes]
+        self._lock = threading.Lock()
+        self._stop = None
+
+    def _sample(self, stop):
+        while not stop.wait(SAMPLE_SECONDS):
+            self._update_peaks()
+
+    def _update_peaks(self):
+        rss = resident_bytes()
+        if rss is None:
+            return
+        with self._lock:
+            for peak in self._peaks.values():
+                peak[0] = max(peak[0], rss)
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        index = len(self.stages)
+        self.stages.append(None)  # keep stages in the order they started
+        depth = self.depth
+        self.depth += 1
+        if self.on_start:
+            self.on_start(name, depth)
+
+        peak = [resident_bytes() or 0]
+        with self._lock:
+            self._peaks[index] = peak
+            if self._stop is None and resident_bytes() is not None:
+                self._stop = threading.Event()
+                threading.Thread(target=self._sample, args=(self._stop,), daemon=True).start()
+
+        meter = Meter(rows_in)
+        started = time.perf_counter()
+        try:
+            yield meter
+        finally:
+            seconds = time.perf_counter() - started
+            self._update_peaks()
+            with self._lock:
+                del self._peaks[index]
+                if not self._peaks and self._stop is not None:
+                    self._stop.set()
+                    self._stop = None
+            self.depth -= 1
+            record = Stage(name, depth, seconds, peak[0] / 2**20 if peak[0] else None, meter.rows_in, meter.rows_out)
+            self.stages[index] = record
+            if self.on_finish:
+                self.on_finish(record)
+
+    def add(self, name, seconds, rows_in=None, rows_out=None, peak_mb=None):
+        """Record a stage measured elsewhere (e.g. in a worker process)."""
+        record = Stage(name, self.depth, seconds, peak_mb, rows_in, rows_out)
+        self.stages.append(record)
+        if self.on_finish:
+            self.on_finish(record)
+        return record
+
+    def frame(self):
+        """The finished stages as a dataframe (see `frame`)."""
+        return frame(s for s in self.stages if s is not None)
+
+    def log(self, **details):
+        """JSON-serializable record of the run: `details` (period, file names...) plus every stage."""
+        return {
+            "started": self.started.isoformat(timespec="seconds"),
+            **{key: str(value) if isinstance(value, (datetime.date, datetime.datetime)) else value for key, value in details.items()},
+            "stages": [s._asdict() for s in self.stages if s is not None],
+        }
+
+    def write_log(self, log_dir=LOG_DIR, **details):
+        """Write the run's JSON log to `log_dir`; returns its path."""
+        os.makedirs(log_dir, exist_ok=True)
+        path = os.path.join(log_dir, f"run-{self.started:%Y%m%d-%H%M%S-%f}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.log(**details), f, indent=2)
+        return path
+
+
+def frame(stages):
+    """Stage records (or their dicts, as in a JSON log) as a dataframe, nested stage names marked with one dot per level."""
+    stages = [s if isinstance(s, Stage) else Stage(**s) for s in stages]
+    return pd.DataFrame({
+        "Stage": ["· " * s.depth + s.name for s in stages],
+        "Seconds": [s.seconds for s in stages],
+        "Peak MB": [s.peak_mb for s in stages],
+        "Rows In": pd.array([s.rows_in for s in stages], dtype="Int64"),
+        "Rows Out": pd.array([s.rows_out for s in stages], dtype="Int64"),
+    })
+
+
+@contextmanager
+def stage(recorder, name, rows_in=None):
+    """recorder.stage(...), or just a Meter when there's no recorder."""
+    if recorder is None:
+        yield Meter(rows_in)
+    else:
+        with recorder.stage(name, rows_in) as meter:
+            yield meter
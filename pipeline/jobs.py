@@ -0,0 +1,279 @@
+"""Background processing jobs for the app.
+
+Processing a period can take minutes. Done inside the Streamlit script run,
+the work is lost when the tab reloads or a widget is touched, and everyone
+using the server waits on the same thread. Instead the app submits a job:
+the two uploads and the run settings are saved to a directory under jobs/,
+and the job runs in a process pool shared by every session of the server
+(JOB_WORKERS at a time; the rest wait their turn).
+
+A job writes its state to status.json in its directory as it goes: queued,
+running (with the current stage and overall progress), done (with the
+bundle, report frames and stage timings) or failed (with the error). Any
+page, including one reloaded mid-run, can poll a job by its id. Finished
+jobs are kept for KEEP_DAYS days, and submitting the same uploads, rules
+and period again returns the existing job instead of processing it twice.
+"""
+
+import datetime
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import shutil
+import threading
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from pipeline import checkpoints as checkpoint, cli, engine, instrument
+from pipeline.config import JOB_DIR
+
+# Jobs processed at once; each also spreads its spatial join and report writing over the cores
+JOB_WORKERS = int(os.environ.get("GCO_JOB_WORKERS", 2))
+
+# Finished jobs (and their bundles) older than this are deleted
+KEEP_DAYS = 7
+
+STATUS_FILE = "status.json"
+REPORTS_FILE = "reports.pkl"
+INPUT_DIR = "inputs"
+CHECKPOINT_DIR = "checkpoints"
+CLEANED_DIR = "cleaned"
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+ACTIVE = (QUEUED, RUNNING)
+
+# Job ids as submit() makes them: the submission time and a random suffix
+JOB_ID = re.compile(r"\d{8}-\d{6}-[0-9a-f]{8}")
+
+_lock = threading.Lock()
+_pool = None
+
+
+def valid_id(job_id):
+    return isinstance(job_id, str) and JOB_ID.fullmatch(job_id) is not None
+
+
+def job_path(job_id, *parts, jobs_dir=JOB_DIR):
+    # Ids come from page URLs; anything else (e.g. "../..") must never become a path
+    if not valid_id(job_id):
+        raise ValueError(f"Not a job id: {job_id!r}")
+    return os.path.join(jobs_dir, job_id, *parts)
+
+
+def read_status(directory):
+    try:
+        with open(os.path.join(directory, STATUS_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_status(directory, status):
+    # Write to a temp file and swap it in so a polling page never reads a partial status
+    path = os.path.join(directory, STATUS_FILE)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(status, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+    return status
+
+
+def update_status(directory, **changes):
+    return write_status(directory, {**(read_status(directory) or {}), **changes})
+
+
+def now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def progress_recorder(directory, top_stages):
+    """A Recorder that writes the running stage and the share of `top_stages` finished to the job's status."""
+    finished = []
+
+    def on_start(name, depth):
+        update_status(directory, stage=name)
+
+    def on_finish(stage):
+        if stage.depth == 0:
+            finished.append(stage.name)
+            update_status(directory, progress=min(len(finished) / len(top_stages), 1.0), stage=f"Finished {stage.name} in {stage.seconds:.1f}s")
+
+    return instrument.Recorder(on_start=on_start, on_finish=on_finish)
+
+
+def run(directory):
+    """Process the job saved in `directory`. Runs in a worker process; the outcome is recorded in its status."""
+    status = update_status(directory, state=RUNNING, started=now(), pid=os.getpid(), progress=0.0)
+    try:
+        job = cli.Job(
+            datetime.date.fromisoformat(status["start"]), datetime.date.fromisoformat(status["end"]),
+            os.path.join(directory, INPUT_DIR, "users", status["users_file"]),
+            os.path.join(directory, INPUT_DIR, "trips", status["trips_file"]),
+        )
+        top_stages = ["load users"] + ([] if status["stream"] else ["load trips"]) + engine.PROCESS_STAGES + ["bundle"]
+        recorder = progress_recorder(directory, top_stages)
+        removed = {}
+        df_users = df_trips = None
+        if status.get("cleaned"):
+            # The app had already read and cleaned the uploads; start from its frames instead of reading them again
+            cleaned = checkpoint.CheckpointStore(os.path.join(directory, INPUT_DIR, CLEANED_DIR))
+            with recorder.stage("load users") as meter:
+                df_users = cleaned.load("users")
+                meter.rows_out = len(df_users)
+            with recorder.stage("load trips") as meter:
+                df_trips = cleaned.load("trips")
+                meter.rows_out = len(df_trips)
+        path, seconds, result = cli.run_job(
+            job, directory, formats=status["formats"], spatial_workers=status["spatial_workers"], stream=status["stream"],
+            recorder=recorder, removed=removed, checkpoint_dir=os.path.join(directory, CHECKPOINT_DIR) if status.get("checkpoints") else None,
+            df_users=df_users, df_trips=df_trips,
+        )
+        # The report frames are kept so the bundle can be rebuilt in other output formats without reprocessing
+        with open(os.path.join(directory, REPORTS_FILE), "wb") as f:
+            pickle.dump(engine.report_frames(result.reports), f, protocol=pickle.HIGHEST_PROTOCOL)
+        update_status(
+            directory, state=DONE, finished=now(), progress=1.0, stage=None, seconds=seconds, bundle=os.path.basename(path),
+            cache_hits=result.cache_hits, cache_misses=result.cache_misses, removed_trips=removed if status["stream"] else None,
+            stages=[s._asdict() for s in recorder.stages if s is not None],
+        )
+    except Exception as error:
+        update_status(directory, state=FAILED, finished=now(), error=f"{type(error).__name__}: {error}", traceback=traceback.format_exc())
+
+
+def pool(restart=False):
+    """The process pool shared by every session of this server, started on first use (or again with `restart`)."""
+    global _pool
+    if _pool is None or restart:
+        # Workers are spawned, not forked: the Streamlit server is multithreaded, and a fork copies only the forking
+        # thread, with any locks the other threads held left locked for good
+        _pool = ProcessPoolExecutor(max_workers=JOB_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def interrupted(status):
+    """True for a queued or running job whose server process has since stopped (it will never finish)."""
+    if status["state"] not in ACTIVE or status["server_pid"] == os.getpid():
+        return False
+    try:
+        os.kill(status["server_pid"], 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass
+    return False
+
+
+def status(job_id, jobs_dir=JOB_DIR):
+    """The job's current status (a dict; see run), or None for an unknown job (or anything that isn't a job id)."""
+    if not valid_id(job_id):
+        return None
+    directory = job_path(job_id, jobs_dir=jobs_dir)
+    current = read_status(directory)
+    if current is not None and interrupted(current):
+        current = update_status(directory, state=FAILED, finished=now(), error="Interrupted: the server stopped before the job finished")
+    return current
+
+
+def recent(limit=10, jobs_dir=JOB_DIR):
+    """Statuses of the most recently submitted jobs, newest first."""
+    if not os.path.isdir(jobs_dir):
+        return []
+    job_ids = sorted((name for name in os.listdir(jobs_dir) if valid_id(name)), reverse=True)
+    statuses = [status(job_id, jobs_dir) for job_id in job_ids[:limit]]
+    return [s for s in statuses if s is not None]
+
+
+def prune(jobs_dir=JOB_DIR, keep_days=KEEP_DAYS):
+    """Delete finished jobs submitted more than `keep_days` days ago."""
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=keep_days)).isoformat(timespec="seconds")
+    for job in recent(limit=None, jobs_dir=jobs_dir):
+        if job["state"] not in ACTIVE and job["submitted"] < cutoff:
+            shutil.rmtree(job_path(job["id"], jobs_dir=jobs_dir), ignore_errors=True)
+
+
+def save_upload(upload, directory):
+    """Copy an uploaded file (Streamlit UploadedFile, or a path) into `directory`; returns its file name."""
+    name = os.path.basename(getattr(upload, "name", None) or os.fspath(upload))
+    if hasattr(upload, "getvalue"):
+        with open(os.path.join(directory, name), "wb") as f:
+            f.write(upload.getvalue())
+    else:
+        shutil.copyfile(upload, os.path.join(directory, name))
+    return name
+
+
+def submit(users, trips, start, end, key=None, stream=False, formats=None, spatial_workers=None, checkpoints=False, cleaned=None, jobs_dir=JOB_DIR):
+    """Queue processing of the `users` and `trips` uploads for `start` through `end`; returns the job id.
+
+    With `checkpoints`, the job snapshots every stage's frames (see
+    pipeline.checkpoints) under its directory; see checkpoint_path.
+    `cleaned` is the uploads already read and cleaned, as (df_users,
+    df_trips); the job then starts from those instead of the files.
+
+    `key` identifies the inputs (uploads, cleaning rules and period): if a
+    job with the same key is queued, running or done, its id is returned
+    and nothing new is processed.
+    """
+    if key is not None:
+        key = hashlib.sha256(repr(key).encode()).hexdigest()
+    with _lock:
+        prune(jobs_dir)
+        if key is not None:
+            for job in recent(limit=None, jobs_dir=jobs_dir):
+                if job.get("key") == key and job["state"] != FAILED:
+                    return job["id"]
+
+        job_id = f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+        directory = job_path(job_id, jobs_dir=jobs_dir)
+        for name in ("users", "trips"):
+            os.makedirs(os.path.join(directory, INPUT_DIR, name))
+        if cleaned is not None:
+            cleaned_inputs = checkpoint.CheckpointStore(os.path.join(directory, INPUT_DIR, CLEANED_DIR))
+            for name, df in zip(("users", "trips"), cleaned):
+                cleaned_inputs.save(name, df)
+        write_status(directory, {
+            "id": job_id, "key": key, "state": QUEUED, "submitted": now(), "server_pid": os.getpid(),
+            "start": start, "end": end,
+            "users_file": save_upload(users, os.path.join(directory, INPUT_DIR, "users")),
+            "trips_file": save_upload(trips, os.path.join(directory, INPUT_DIR, "trips")),
+            "stream": stream, "formats": formats, "spatial_workers": spatial_workers, "checkpoints": checkpoints,
+            "cleaned": cleaned is not None,
+            "progress": 0.0, "stage": None,
+        })
+        try:
+            future = pool().submit(run, directory)
+        except BrokenProcessPool:
+            # A worker died (e.g., out of memory) and took the pool with it; start a fresh one
+            future = pool(restart=True).submit(run, directory)
+
+    def check(future):
+        # run() records its own errors; this catches a worker that died outright (e.g., out of memory)
+        if future.exception() is not None:
+            update_status(directory, state=FAILED, finished=now(), error=f"{type(future.exception()).__name__}: {future.exception()}")
+
+    future.add_done_callback(check)
+    return job_id
+
+
+def bundle_path(job, jobs_dir=JOB_DIR):
+    """Where a finished job's ZIP bundle is (in the output formats it was submitted with)."""
+    return job_path(job["id"], job["bundle"], jobs_dir=jobs_dir)
+
+
+def checkpoint_path(job, jobs_dir=JOB_DIR):
+    """Where a job submitted with `checkpoints` keeps its stage checkpoints."""
+    return cli.checkpoint_path(cli.Job(job["start"], job["end"], job["users_file"], job["trips_file"]), job_path(job["id"], CHECKPOINT_DIR, jobs_dir=jobs_dir))
+
+
+def load_reports(job, jobs_dir=JOB_DIR):
+    """The finished job's {file name: dataframe}."""
+    with open(job_path(job["id"], REPORTS_FILE, jobs_dir=jobs_dir), "rb") as f:
+        return pickle.load(f)
@@ -0,0 +1,186 @@
+"""Per-period partial aggregates, saved locally so multi-period reports don't need the raw exports.
+
+Every processed run saves three small tables for its reporting period:
+
+* individual: Trips/Miles/VMR/CO2/Dollars sums and log counts per
+  User ID x Method x ESO x ESO Adjust State/Fed x Home ZIP
+* territory_logs: log counts per Territory x Method
+* new_users: new user counts per Territory
+
+These sum cleanly across periods, so quarterly and year-to-date Tableau and
+GDOT reports are assembled by combining the stored partials instead of
+rescanning the cumulative trip exports.
+
+Partials are stored per period and per export: processing the same Users
+and Trips files for a period again replaces what they saved, while another
+export for the same period (another network's, say) is stored alongside
+and can be combined with it.
+"""
+
+import datetime
+import hashlib
+import os
+import sqlite3
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pandas as pd
+
+from pipeline import dimensions, instrument, reports
+from pipeline.config import CACHE_DIR
+
+DB_FILE = "periods.sqlite"
+
+INDIVIDUAL_KEYS = ['User ID', 'Method', 'ESO', 'ESO Adjust State/Fed', 'Home ZIP']
+
+PeriodPartials = namedtuple("PeriodPartials", ["individual", "territory_logs", "new_users"])
+
+# The export a period's partials came from: `source` is a digest of the Users and Trips files, `label` the Trips file name
+Export = namedtuple("Export", ["source", "label"])
+
+# One saved (period, export); partials saved before exports were tracked have an empty source and label
+StoredPeriod = namedtuple("StoredPeriod", ["start", "end", "source", "label", "saved"])
+
+TABLES = {
+    "individual": (INDIVIDUAL_KEYS, reports.METRICS + ['Logs']),
+    "territory_logs": (['Territory', 'Method'], ['Logs']),
+    "new_users": (['Territory'], ['New Users']),
+}
+
+
+def period_partials(cube, df_users, recorder=None):
+    """Partial aggregates for one period from the trip cube (see engine.build_cube) and the enriched users."""
+    # Rows with a missing key are only kept in the cube for the Territory log counts; the reports never include them
+    individual = cube.dropna(subset=INDIVIDUAL_KEYS).reset_index(drop=True)
+
+    with instrument.stage(recorder, "groupby Territory x Method logs", len(cube)) as meter:
+        territory_logs = cube[['Method', 'Logs']].assign(Territory=dimensions.to_territory(cube['ESO Adjust State/Fed']))
+        territory_logs = territory_logs.groupby(['Territory', 'Method'], as_index=False, observed=True)['Logs'].sum()
+        meter.rows_out = len(territory_logs)
+
+    with instrument.stage(recorder, "groupby Territory new users", len(df_users)) as meter:
+        new_users = df_users[['New Users']].assign(Territory=dimensions.to_territory(df_users['ESO Adjust State/Fed']))
+        new_users = new_users.groupby('Territory', as_index=False, observed=True)['New Users'].sum()
+        meter.rows_out = len(new_users)
+
+    return PeriodPartials(individual, territory_logs, new_users)
+
+
+def combine_partials(partials):
+    """Sum a list of PeriodPartials into one."""
+    combined = []
+    for name, (keys, values) in TABLES.items():
+        frames = pd.concat([getattr(p, name) for p in partials], ignore_index=True)
+        combined.append(frames.groupby(keys, as_index=False, observed=True)[values].sum())
+    return PeriodPartials(*combined)
+
+
+def file_export(users_path, trips_path):
+    """The Export of a Users and a Trips file."""
+    digest = hashlib.sha256()
+    for path in (users_path, trips_path):
+        file_digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                file_digest.update(block)
+        digest.update(file_digest.digest())
+    return Export(digest.hexdigest()[:16], os.path.basename(trips_path))
+
+
+def check_disjoint(periods):
+    """Combining overlapping periods would double count, so refuse to.
+
+    The same period may appear more than once (from different exports, e.g. one per network); it's counted as one here.
+    """
+    periods = sorted(set(periods))
+    for (_, end), (next_start, _) in zip(periods, periods[1:]):
+        if next_start <= end:
+            raise ValueError(f"Periods overlap: one ends {end} and the next starts {next_start}")
+
+
+class PeriodStore:
+    """SQLite-backed store of PeriodPartials keyed by (start date, end date, export source)."""
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(CACHE_DIR, DB_FILE)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.connect() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(periods)")]
+            if columns and "source" not in columns:
+                self.add_sources(conn)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS periods (start TEXT, end TEXT, source TEXT, label TEXT, saved TEXT, PRIMARY KEY (start, end, source))"
+            )
+
+    @staticmethod
+    def add_sources(conn):
+        # Stores written before exports were tracked: keep their periods, with an empty source
+        conn.execute("ALTER TABLE periods RENAME TO periods_unsourced")
+        conn.execute("CREATE TABLE periods (start TEXT, end TEXT, source TEXT, label TEXT, saved TEXT, PRIMARY KEY (start, end, source))")
+        conn.execute("INSERT INTO periods SELECT start, end, '', '', saved FROM periods_unsourced")
+        conn.execute("DROP TABLE periods_unsourced")
+        for name in TABLES:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone():
+                conn.execute(f"ALTER TABLE {name} ADD COLUMN source TEXT DEFAULT ''")
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def save(self, start, end, partials, export=None):
+        """Save the partials for one period from one export (an Export), replacing any that export saved for it before."""
+        export = export or Export("", "")
+        key = (start.isoformat(), end.isoformat(), export.source)
+        with self.connect() as conn:
+            for name in TABLES:
+                table = getattr(partials, name).assign(period_start=key[0], period_end=key[1], source=key[2])
+                if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone():
+                    conn.execute(f"DELETE FROM {name} WHERE period_start = ? AND period_end = ? AND source = ?", key)
+                table.to_sql(name, conn, if_exists="append", index=False)
+            conn.execute(
+                "INSERT OR REPLACE INTO periods (start, end, source, label, saved) VALUES (?, ?, ?, ?, ?)",
+                (*key, export.label, datetime.datetime.now().isoformat(timespec="seconds")),
+            )
+
+    def periods(self):
+        """Stored periods as a sorted list of StoredPeriod."""
+        with self.connect() as conn:
+            rows = conn.execute("SELECT start, end, source, label, saved FROM periods ORDER BY start, end, label, saved").fetchall()
+        return [
+            StoredPeriod(datetime.date.fromisoformat(start), datetime.date.fromisoformat(end), source, label, saved)
+            for start, end, source, label, saved in rows
+        ]
+
+    def load(self, period):
+        tables = []
+        with self.connect() as conn:
+            for name, (keys, values) in TABLES.items():
+                tables.append(pd.read_sql_query(
+                    f"SELECT * FROM {name} WHERE period_start = ? AND period_end = ? AND source = ?",
+                    conn,
+                    params=(period.start.isoformat(), period.end.isoformat(), period.source),
+                )[keys + values])
+        return PeriodPartials(*tables)
+
+    def combine(self, periods):
+        """Load and sum the partials for several StoredPeriods (non-overlapping, unless for the same period from different exports)."""
+        check_disjoint((period.start, period.end) for period in periods)
+        # One export saved under two periods would count its trips twice
+        sources = [period.source for period in periods if period.source]
+        for source in set(sources):
+            if sources.count(source) > 1:
+                raise ValueError(f"Export {source} is saved for more than one of these periods; its trips would be counted twice")
+        return combine_partials([self.load(period) for period in periods])
+
+
+def build_reports(partials, date):
+    """Tableau and GDOT reports from (possibly combined) partials; `date` fills the Tableau Date column."""
+    df_individual, df_individual_adjusted = reports.individual_tables(partials.individual)
+    df_tableau = reports.tableau_report(df_individual, date)
+    df_gdot = reports.gdot_report(df_individual_adjusted, partials.territory_logs, partials.new_users)
+    return df_tableau, df_gdot
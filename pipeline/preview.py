@@ -0,0 +1,98 @@
+"""Sampled preview: quick, scaled estimates of the Tableau and GDOT reports.
+
+A full run takes minutes on a large export, which is a long wait to find
+out the wrong month's Trips report was uploaded. A preview runs the same
+pipeline on a sample of the users and only their trips, so it answers in
+seconds:
+
+* every user is placed in a stratum by network ('Networks') and ESO (the
+  spatial join runs on all users, so this also warms the location cache
+  for the full run); users in the Trips report but not the Users report
+  form strata by their trips' network
+* SAMPLE_FRACTION of each stratum is drawn at random (small strata are
+  kept whole, up to MIN_STRATUM_USERS), and each sampled user stands in
+  for stratum size / sampled users
+* the trip cube, new user counts and logger counts are weighted by that,
+  and the reports are built from them as usual
+
+The results are estimates of the full run's totals, not figures to report.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from pipeline import engine, instrument, periods, reports
+from pipeline.boundaries import load_boundaries
+from pipeline.geocache import GeoCache
+
+SAMPLE_FRACTION = 0.1
+
+# Strata with at most this many users are kept whole; larger ones never drop below it
+MIN_STRATUM_USERS = 10
+
+# Count columns, rounded to whole numbers once scaled
+GDOT_COUNTS = ['New Users', 'Loggers', 'Clean Loggers'] + [f'{mode} Logs' for mode in reports.CLEAN_MODES]
+
+Preview = namedtuple("Preview", ["tableau", "gdot", "sampled_users", "total_users", "sampled_trips", "total_trips", "strata"])
+
+
+def sample_weights(df_users, df_trips, fraction=SAMPLE_FRACTION, min_users=MIN_STRATUM_USERS, seed=0):
+    """Stratified sample of everyone in the users or trips, as {User ID: weight} (a Series) for the sampled users.
+
+    `df_users` must be enriched (it needs 'User ID' and 'ESO'). Returns (weights, number of strata).
+    """
+    people = df_users[['User ID', 'Networks']].assign(ESO=df_users['ESO'].astype(object)).drop_duplicates('User ID')
+    # Trips whose user isn't in the Users report still count in the GDOT log totals
+    orphans = df_trips.loc[~df_trips['User ID'].isin(people['User ID']), ['User ID', 'Networks']].drop_duplicates('User ID')
+    people = pd.concat([people, orphans], ignore_index=True)
+
+    strata = people.groupby(['Networks', 'ESO'], dropna=False, sort=False).ngroup()
+    size = strata.map(strata.value_counts())
+    take = np.maximum(np.round(size * fraction), np.minimum(size, min_users))
+    # A random rank within each stratum; the lowest `take` are sampled
+    rank = pd.Series(np.random.default_rng(seed).random(len(people))).groupby(strata).rank(method="first")
+    sampled = (rank <= take).to_numpy()
+    weights = pd.Series((size / take).to_numpy()[sampled], index=people['User ID'].to_numpy()[sampled], name='Weight')
+    return weights, strata.nunique()
+
+
+def run(df_users, df_trips, startDate, endDate, boundaries=None, use_cache=True, recorder=None, fraction=SAMPLE_FRACTION, seed=0):
+    """Estimate the Tableau and GDOT reports from a stratified sample of cleaned users and trips (see the module docstring)."""
+    if boundaries is None:
+        boundaries = load_boundaries()
+    cache = GeoCache(boundaries.version) if use_cache else None
+    total_trips = len(df_trips)
+
+    with instrument.stage(recorder, "spatial enrichment", len(df_users)) as meter:
+        df_users = engine.enrich_users(df_users, boundaries, cache=cache, recorder=recorder)
+        meter.rows_out = len(df_users)
+    df_users = engine.flag_new_users(df_users, startDate, endDate)
+
+    with instrument.stage(recorder, "sample users", len(df_users)) as meter:
+        weights, strata = sample_weights(df_users, df_trips, fraction, seed=seed)
+        df_users = df_users[df_users['User ID'].isin(weights.index)]
+        df_trips = df_trips[df_trips['User ID'].isin(weights.index)]
+        meter.rows_out = len(weights)
+
+    # Each sampled user's trips and new user flag count for the users they stand in for
+    with instrument.stage(recorder, "aggregate", len(df_trips)) as meter:
+        df_cube = engine.build_cube(df_trips, df_users, recorder)
+        scale = df_cube['User ID'].map(weights).to_numpy()[:, None]
+        df_cube[reports.METRICS + ['Logs']] = df_cube[reports.METRICS + ['Logs']] * scale
+        df_users = df_users.assign(**{'New Users': df_users['New Users'] * df_users['User ID'].map(weights)})
+        partials = periods.period_partials(df_cube, df_users, recorder)
+        meter.rows_out = len(partials.individual)
+
+    with instrument.stage(recorder, "reports"):
+        df_individual, df_individual_adjusted = reports.individual_tables(partials.individual, recorder)
+        df_tableau = reports.tableau_report(df_individual, startDate, recorder)
+        df_gdot = reports.gdot_report(df_individual_adjusted, partials.territory_logs, partials.new_users, recorder, weights=weights)
+        df_gdot[GDOT_COUNTS] = df_gdot[GDOT_COUNTS].round()
+        df_tableau['Trips'] = df_tableau['Trips'].round()
+
+    return Preview(
+        tableau=df_tableau, gdot=df_gdot, sampled_users=len(weights), total_users=int(round(weights.sum())),
+        sampled_trips=len(df_trips), total_trips=total_trips, strata=strata,
+    )
@@ -0,0 +1,222 @@
+"""Report builders: Tableau, GDOT, TDM and the ESO audit.
+
+The Tableau and GDOT reports are built from the same inputs whether they
+cover a single run or several stored periods combined (see
+pipeline.periods): the per-user individual sums, the Territory x Method log
+counts, and the new user counts by Territory.
+"""
+
+import numpy as np
+
+from pipeline import checkpoints as checkpoint, instrument
+from pipeline.dimensions import to_audit_alias, to_territory
+
+METRICS = ['Trips', 'Miles', 'VMR', 'CO2', 'Dollars']
+
+# Modes reported to GDOT (everything except Drive)
+CLEAN_MODES = ['Bike', 'Carpool', 'CWW', 'Scooter', 'Telework', 'Transit', 'Vanpool', 'Walk']
+
+GRAMS_TO_POUNDS = 0.00220462
+
+
+def individual_tables(individual, recorder=None):
+    """Collapse the individual sums to df_individual (unadjusted ESO) and df_individual_adjusted (ESO adjusted for State/Fed)."""
+    with instrument.stage(recorder, "groupby individual", len(individual)) as meter:
+        df_individual = individual.groupby(['User ID', 'Method', 'ESO', 'Home ZIP'], as_index=False, observed=True)[METRICS].sum()
+        meter.rows_out = len(df_individual)
+    with instrument.stage(recorder, "groupby individual adjusted", len(individual)) as meter:
+        df_individual_adjusted = individual.groupby(['User ID', 'Method', 'ESO Adjust State/Fed', 'Home ZIP'], as_index=False, observed=True)[METRICS].sum()
+        meter.rows_out = len(df_individual_adjusted)
+    return df_individual, df_individual_adjusted
+
+
+def tableau_report(df_individual, date, recorder=None):
+    # This report wants one record per O/D Pair by Method. We use the unadjusted ESO for this report.
+
+    # Collapse the individual level data to one record per Method/ESO/Home ZIP triplet
+    with instrument.stage(recorder, "groupby Method x ESO x Home ZIP", len(df_individual)) as meter:
+        df_tableau = df_individual.groupby(['Method', 'ESO', 'Home ZIP'], observed=True)[METRICS].sum().reset_index()
+        meter.rows_out = len(df_tableau)
+
+    # Add a date field, then keep only required columns in their desired order
+    df_tableau['Date'] = date
+    keep_columns = ['Date', 'Home ZIP', 'ESO', 'Method', 'Trips', 'Miles', 'VMR', 'CO2', 'Dollars']
+    df_tableau = df_tableau[keep_columns]
+
+    # We don't want drivers in the viz:
+    df_tableau = df_tableau[df_tableau['Method'] != 'drive']
+
+    # Sort by ZIP, ESO, and Method
+    return df_tableau.sort_values(by=['Home ZIP', 'ESO', 'Method'])
+
+
+def count_loggers(df_individual_adjusted, recorder=None, weights=None):
+    """Count loggers and clean loggers by Territory.
+
+    Logger always equals 1 and Clean Loggers is 1 for anything but Drive; taking the max per user means even one clean
+    trip logged makes you a clean logger for counting. With `weights` (a Series by User ID, see pipeline.preview), each
+    user counts as their weight instead of 1.
+    """
+    df_loggers = df_individual_adjusted[['User ID', 'ESO Adjust State/Fed', 'Method']].copy()
+    df_loggers['Logger'] = 1 if weights is None else df_loggers['User ID'].map(weights)
+    df_loggers['Clean Loggers'] = (df_loggers['Method'] != 'Drive').astype(int) * df_loggers['Logger']
+
+    with instrument.stage(recorder, "groupby loggers per user", len(df_loggers)) as meter:
+        df_loggers = df_loggers.groupby(['User ID', 'ESO Adjust State/Fed'], as_index=False, observed=True).agg({'Clean Loggers': 'max', 'Logger': 'max'})
+        meter.rows_out = len(df_loggers)
+    with instrument.stage(recorder, "groupby loggers per Territory", len(df_loggers)) as meter:
+        df_loggers['Territory'] = to_territory(df_loggers['ESO Adjust State/Fed'])
+        df_loggers = df_loggers.groupby(['Territory'], observed=True).agg({'Clean Loggers': 'sum', 'Logger': 'sum'})
+        meter.rows_out = len(df_loggers)
+    return df_loggers
+
+
+def gdot_report(df_individual_adjusted, df_gdot_long, df_gdot_newusers, recorder=None, checkpoints=None, weights=None):
+    # This report wants one line per ESO, called "Territory", and using the ESO Adjusted for State/Fed
+    # Data Fields: "New Users", "Loggers",  "Clean Loggers", "Carpool Logs", "Vanpool Logs", "Transit Logs", "Telework Logs",
+    #              "Walk Logs", "Bike Logs", "Scooter Logs", "CWW Logs", "Reduced VMT", "Reduced CO2 (pounds)"
+
+    # Aggregate Individual-level data to Territory
+    with instrument.stage(recorder, "groupby Territory", len(df_individual_adjusted)) as meter:
+        df_gdot = df_individual_adjusted.assign(Territory=to_territory(df_individual_adjusted['ESO Adjust State/Fed']))
+        df_gdot = df_gdot.groupby(['Territory'], observed=True)[METRICS].sum().reset_index()
+        meter.rows_out = len(df_gdot)
+
+    # CO2 is in grams create new field with value converted to pounds:
+    df_gdot['Reduced CO2 (pounds)'] = df_gdot['CO2'] * GRAMS_TO_POUNDS
+
+    # Rename fields to desired output names for the GDOT report
+    df_gdot = df_gdot.rename(columns={'VMR': 'Reduced VMT', 'Dollars': 'Money Saved'})
+
+    # Add the new user counts
+    df_gdot = df_gdot.merge(df_gdot_newusers, on='Territory', how='inner')
+
+    # Reshape the Territory x Method log counts from long to wide format, dumping the "Drive" column because we don't report
+    # driving trips to GDOT, then change nulls to zeroes and rename fields to desired output names
+    with instrument.stage(recorder, "pivot Territory x Method logs", len(df_gdot_long)) as meter:
+        df_gdot_wide = df_gdot_long.pivot(index='Territory', columns='Method', values='Logs').reindex(columns=CLEAN_MODES)
+        meter.rows_out = len(df_gdot_wide)
+    df_gdot_wide = df_gdot_wide.fillna(0).reset_index()
+    df_gdot_wide = df_gdot_wide.rename(columns={mode: f'{mode} Logs' for mode in CLEAN_MODES})
+    checkpoint.save(checkpoints, "gdot_wide", df_gdot_wide)
+    df_gdot = df_gdot.merge(df_gdot_wide, on='Territory', how='inner')
+
+    # And now also the Loggers and Clean Loggers fields, renaming "Logger" to "Loggers" to match desired output
+    df_loggers = checkpoint.save(checkpoints, "df_loggers", count_loggers(df_individual_adjusted, recorder, weights))
+    df_gdot = df_gdot.merge(df_loggers, on='Territory', how='inner')
+    df_gdot = df_gdot.rename(columns={'Logger': 'Loggers'})
+
+    # Keep just what we need in the desired order
+    keep_columns = ['Territory', 'New Users', 'Loggers', 'Clean Loggers', 'Carpool Logs', 'Vanpool Logs', 'Transit Logs', 'Telework Logs', 'Walk Logs',
+                    'Bike Logs', 'Scooter Logs', 'CWW Logs', 'Reduced VMT', 'Reduced CO2 (pounds)', 'Money Saved']
+    return df_gdot[keep_columns]
+
+
+def tdm_report(df_users, df_individual, date, recorder=None, checkpoints=None):
+    # This report wants one record per active user, with per-Method totals reshaped wide. `date` fills the Month column.
+
+    # Start with the Users Dataframe: create a new df with just the fields we need
+    # Using the unadjusted for now?
+
+    df_tdm = df_users[['User ID', 'LonHome', 'LatHome', 'LonWork', 'LatWork', 'Active Account', 'New Users', 'Created', 
+                    'Work County FIPS', 'Work County Name', 'Work ZIP', 'Home County FIPS', 'Home County Name', 'Home ZIP',
+                    'Legacyid', 'ESO', 'Tmas']].copy()
+
+    # Add a month field
+    df_tdm['Month'] = date
+
+    # Legacy is blank if there's no legacy ID, and takes a value of 1 if there is one:
+    df_tdm['Legacy'] = np.nan 
+    df_tdm.loc[df_tdm['Legacyid'] != "", 'Legacy'] = 1 
+
+    # Rename fields to have the desired output names
+    df_tdm.rename(columns={'User ID': 'User_ID', 'LonHome': 'Home_X', 'LatHome': 'Home_Y', 'LonWork': 'Work_X', 
+                        'LatWork': 'Work_Y', 'Active Account': 'Active', 'New Users': 'New', 'Created': 'Created_Date', 
+                        'Work County FIPS': 'County_ID_Work', 'Work County Name': 'County_Work', 'Work ZIP': 'Zip_Code_Work', 
+                        'Home County FIPS': 'County_ID_Home', 'Home County Name': 'County_Home', 'Home ZIP': 'Zip_Code_Home'}, inplace = True)
+
+    # Next, we move to the df_individual dataframe (contains one aggregated record per user); using unadjusted ESO
+
+    # Convert grams to pounds
+    df_individual = df_individual.assign(CO2_lbs=df_individual['CO2'] * GRAMS_TO_POUNDS)
+
+
+    # Reshape long to wide
+
+    with instrument.stage(recorder, "pivot User ID x Method", len(df_individual)) as meter:
+        df_individual_wide = df_individual.pivot(index='User ID', columns='Method', values=['Trips', 'Miles', 'VMR', 'CO2_lbs', 'Dollars']).reset_index()
+        meter.rows_out = len(df_individual_wide)
+    df_individual_wide.columns = [f"{method}_{var}" if method else var for var, method in df_individual_wide.columns]
+    df_individual_wide.rename(columns={'User ID': 'User_ID'}, inplace=True)
+
+
+    # Intermediate results are saved for diagnostic purposes in checkpoint mode (see pipeline.checkpoints)
+    checkpoint.save(checkpoints, "individual_wide", df_individual_wide)
+
+    # Add the df_individual_wide data to the main TDM dataframe
+    df_tdm = df_tdm.merge(df_individual_wide, on='User_ID', how='left')
+
+
+    # Replace missing values with zeroes
+    patterns = ['Trips', 'Miles', 'VMR', 'CO2_lbs', 'Dollars']
+    columns_to_replace = [col for col in df_tdm.columns if any(pattern in col for pattern in patterns)]
+    df_tdm[columns_to_replace] = df_tdm[columns_to_replace].fillna(0)
+
+    # Create Clean fields and Loggers fields
+    # Initialize aggregated columns
+
+    df_tdm["Clean_Trips"] = 0
+    df_tdm["Clean_Miles"] = 0
+    df_tdm["Clean_VMR"] = 0
+    df_tdm["Clean_CO2_lbs"] = 0
+    df_tdm["Clean_Dollars"] = 0
+
+    # Create "Clean" totals for trips, miles, VMR, CO2 reduction, and dollars saved by summing across all of the different modes 
+    for mode in CLEAN_MODES:
+        df_tdm[f"{mode}_Logger"] = np.where(df_tdm[f"{mode}_Trips"].fillna(0) > 0, 1, np.nan)
+
+        df_tdm["Clean_Trips"] += df_tdm[f"{mode}_Trips"].fillna(0)
+        df_tdm["Clean_Miles"] += df_tdm[f"{mode}_Miles"].fillna(0)
+        df_tdm["Clean_VMR"] += df_tdm[f"{mode}_VMR"].fillna(0)
+        df_tdm["Clean_CO2_lbs"] += df_tdm[f"{mode}_CO2_lbs"].fillna(0)
+        df_tdm["Clean_Dollars"] += df_tdm[f"{mode}_Dollars"].fillna(0)
+
+    # Create Clean_Logger column
+    df_tdm["Clean_Logger"] = np.where(df_tdm["Clean_Trips"] > 0, 1, np.nan)
+
+
+    # Rename Tmas to TMA to match desired column name in output
+    df_tdm.rename(columns={'Tmas': 'TMA'}, inplace=True)
+
+    # Reorder to match desired output
+    keep_columns = ['User_ID', 'Home_X', 'Home_Y', 'Work_X', 'Work_Y', 'TMA', 'Legacy', 'Active', 'New', 'Created_Date', 
+                    'Bike_Logger', 'Bike_Trips', 'Bike_Miles', 'Bike_VMR', 'Bike_CO2_lbs', 'Bike_Dollars', 
+                    'Carpool_Logger', 'Carpool_Trips', 'Carpool_Miles', 'Carpool_VMR', 'Carpool_CO2_lbs', 'Carpool_Dollars', 
+                    'CWW_Logger', 'CWW_Trips', 'CWW_Miles', 'CWW_VMR', 'CWW_CO2_lbs', 'CWW_Dollars', 
+                    'Scooter_Logger', 'Scooter_Trips', 'Scooter_Miles', 'Scooter_VMR', 'Scooter_CO2_lbs', 'Scooter_Dollars', 
+                    'Telework_Logger', 'Telework_Trips', 'Telework_Miles', 'Telework_VMR', 'Telework_CO2_lbs', 'Telework_Dollars', 
+                    'Transit_Logger', 'Transit_Trips', 'Transit_Miles', 'Transit_VMR', 'Transit_CO2_lbs', 'Transit_Dollars', 
+                    'Vanpool_Logger', 'Vanpool_Trips', 'Vanpool_Miles', 'Vanpool_VMR', 'Vanpool_CO2_lbs', 'Vanpool_Dollars', 
+                    'Walk_Logger', 'Walk_Trips', 'Walk_Miles', 'Walk_VMR', 'Walk_CO2_lbs', 'Walk_Dollars', 
+                    'Clean_Logger', 'Clean_Trips', 'Clean_Miles', 'Clean_VMR', 'Clean_CO2_lbs', 'Clean_Dollars', 
+                    'Month', 'County_ID_Work', 'County_Work', 'Zip_Code_Work', 'ESO', 'County_ID_Home', 'County_Home', 'Zip_Code_Home']
+    df_tdm = df_tdm[keep_columns]
+
+    # keep only active users
+    return df_tdm[df_tdm['Active'] == 1]
+
+
+def audit_report(df_users):
+    # Data Audit: Flag records where ESO from spatial join does not match 'Tmas' in Ride Amigos
+
+    df_diff = df_users[['User ID', 'First Name', 'Last Name', 'Work Location', 'Tmas', 'ESO']].copy()
+    df_diff = df_diff.rename(columns={'Tmas': 'TMA', 'ESO': 'ESO Geocoded'})
+
+    # Remove colons and rename specific values to match what is in TMA (see dimensions.audit_alias)
+    df_diff['ESO Geocoded'] = to_audit_alias(df_diff['ESO Geocoded']).astype(object)
+
+    # Change Null values of TMA to "Unknown/Out of Region"
+    df_diff['TMA'] = df_diff['TMA'].fillna("Unknown/Out of Region")
+
+    # Keep only rows where the contents of ESO Geocoded is different from what was in TMA
+    return df_diff.loc[df_diff['ESO Geocoded'] != df_diff['TMA']]
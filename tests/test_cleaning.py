@@ -0,0 +1,75 @@
+"""Parsing the cleaning rules file and applying the rules."""
+
+import json
+
+import pandas as pd
+import pytest
+
+from pipeline import cleaning
+
+
+@pytest.fixture
+def rules_file(tmp_path):
+    def write(config):
+        path = tmp_path / "cleaning_rules.json"
+        path.write_text(json.dumps(config), encoding="utf-8")
+        return str(path)
+    return write
+
+
+def test_shipped_rules_file_parses():
+    rules = cleaning.load_rules(cleaning.RULES_FILE)
+    assert rules.networks and rules.emails and rules.employers and rules.trip_user_names
+    assert rules.email_pattern is not None
+
+
+def test_missing_lists_match_nothing(rules_file):
+    rules = cleaning.load_rules(rules_file({}))
+    assert rules == cleaning.Rules(frozenset(), None, frozenset(), frozenset(), frozenset())
+    users = pd.DataFrame({"Networks": ["A"], "Email": ["a@test.com"], "Employer Name": ["E"]})
+    cleaned, counts = cleaning.clean_users(users, rules)
+    assert len(cleaned) == 1 and counts == {"networks": 0, "email_domains": 0, "emails": 0, "employers": 0}
+
+
+def test_email_domains_are_literal(rules_file):
+    rules = cleaning.load_rules(rules_file({"email_domains": ["test.com", "a+b.org"]}))
+    emails = pd.Series(["x@test.com", "x@testXcom", "x@sub.test.com", "x@a+b.org", "x@aab.org", "test.com", None])
+    mask = cleaning.rule_mask(pd.DataFrame({"Email": emails}), "email_domains", "Email", rules)
+    assert mask.tolist() == [True, False, False, True, False, False, False]
+
+
+def test_exact_lists_match_whole_values(rules_file):
+    rules = cleaning.load_rules(rules_file({"networks": ["Test Network"], "emails": ["qa@example.org"]}))
+    df = pd.DataFrame({"Networks": ["Test Network", "Test Network 2", "test network"]})
+    assert cleaning.rule_mask(df, "networks", "Networks", rules).tolist() == [True, False, False]
+    df = pd.DataFrame({"Email": ["qa@example.org", "qa@example.org.uk"]})
+    assert cleaning.rule_mask(df, "emails", "Email", rules).tolist() == [True, False]
+
+
+def test_each_removed_row_counts_under_its_first_rule(rules_file):
+    rules = cleaning.load_rules(rules_file({
+        "networks": ["Test Network"], "email_domains": ["test.com"], "emails": ["a@test.com", "b@x.org"],
+        "trip_user_names": ["Network Log"],
+    }))
+    trips = pd.DataFrame({
+        "Networks": ["Test Network", "Real", "Real", "Real", "Real"],
+        "User Email": ["a@test.com", "a@test.com", "b@x.org", "c@x.org", "d@x.org"],
+        "User Name": ["Network Log", "A", "B", "Network Log", "D"],
+    })
+    cleaned, counts = cleaning.clean_trips(trips, rules)
+    assert cleaned["User Email"].tolist() == ["d@x.org"]
+    assert counts == {"networks": 1, "email_domains": 1, "emails": 1, "trip_user_names": 1}
+
+
+def test_rules_version_follows_the_file(rules_file):
+    path = rules_file({"networks": ["A"]})
+    version = cleaning.rules_version(path)
+    assert cleaning.rules_version(rules_file({"networks": ["A"]})) == version
+    assert cleaning.rules_version(rules_file({"networks": ["B"]})) != version
+
+
+def test_invalid_rules_file_is_an_error(tmp_path):
+    path = tmp_path / "cleaning_rules.json"
+    path.write_text('{"networks": ["A",]}', encoding="utf-8")
+    with pytest.raises(ValueError):
+        cleaning.load_rules(str(path))
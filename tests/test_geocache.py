@@ -0,0 +1,89 @@
+"""GeoCache hits and misses, boundary versions and aging."""
+
+import datetime
+import sqlite3
+
+import numpy as np
+import pytest
+
+from pipeline import geocache
+from pipeline.geocache import GeoCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / geocache.DB_FILE)
+
+
+def columns(n, eso="ESO A"):
+    return {"eso": np.array([eso] * n, dtype=object), "zip": np.array(["30303"] * n, dtype=object),
+            "county_name": np.array(["Fulton"] * n, dtype=object), "county_fips": np.array(["13121"] * n, dtype=object)}
+
+
+def last_seen(path):
+    with sqlite3.connect(path) as conn:
+        return dict(((lon, lat), seen) for lon, lat, seen in conn.execute("SELECT lon_key, lat_key, last_seen FROM geocode"))
+
+
+def test_hits_and_misses(path):
+    cache = GeoCache("v1", path)
+    cache.store(np.array([-84.1, -84.2]), np.array([33.1, 33.2]), columns(2))
+
+    cache = GeoCache("v1", path)
+    # A repeated coordinate, one rounding to a stored key, and one never stored
+    found, cached = cache.lookup(np.array([-84.1, -84.2, -84.2000000001, -84.3]), np.array([33.1, 33.2, 33.2, 33.3]))
+    np.testing.assert_array_equal(found, [True, True, True, False])
+    assert list(cached["eso"][:3]) == ["ESO A"] * 3 and cached["eso"][3] is None
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_outside_every_polygon_is_cached_as_none(path):
+    cache = GeoCache("v1", path)
+    cache.store(np.array([-90.0]), np.array([40.0]), {key: np.array([None], dtype=object) for key in geocache.COLUMNS})
+    found, cached = cache.lookup(np.array([-90.0]), np.array([40.0]))
+    assert found[0] and all(cached[key][0] is None for key in geocache.COLUMNS)
+
+
+def test_stored_again_replaces(path):
+    cache = GeoCache("v1", path)
+    cache.store(np.array([-84.1]), np.array([33.1]), columns(1, "ESO A"))
+    cache.store(np.array([-84.1]), np.array([33.1]), columns(1, "ESO B"))
+    assert cache.lookup(np.array([-84.1]), np.array([33.1]))[1]["eso"][0] == "ESO B"
+
+
+def test_new_boundary_version_drops_old_entries(path):
+    GeoCache("v1", path).store(np.array([-84.1]), np.array([33.1]), columns(1))
+    cache = GeoCache("v2", path)
+    assert not cache.lookup(np.array([-84.1]), np.array([33.1]))[0][0]
+    assert last_seen(path) == {}
+
+
+def test_entries_not_seen_for_max_age_are_dropped(path):
+    cache = GeoCache("v1", path)
+    cache.store(np.array([-84.1, -84.2, -84.3]), np.array([33.1, 33.2, 33.3]), columns(3))
+    today = datetime.date.today()
+    stale = (today - datetime.timedelta(days=geocache.MAX_AGE_DAYS + 1)).isoformat()
+    recent = (today - datetime.timedelta(days=geocache.MAX_AGE_DAYS - 1)).isoformat()
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE geocode SET last_seen = ? WHERE lat_key = ?", (stale, 33_100_000))
+        conn.execute("UPDATE geocode SET last_seen = ? WHERE lat_key IN (?, ?)", (recent, 33_200_000, 33_300_000))
+
+    cache = GeoCache("v1", path)
+    found, _ = cache.lookup(np.array([-84.1, -84.2]), np.array([33.1, 33.2]))
+    np.testing.assert_array_equal(found, [False, True])
+    # Looking an entry up restarts its clock; the one not looked up keeps its age
+    assert last_seen(path) == {(-84_200_000, 33_200_000): today.isoformat(), (-84_300_000, 33_300_000): recent}
+
+
+def test_cache_without_last_seen_is_migrated(path):
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE geocode (version TEXT, lon_key INTEGER, lat_key INTEGER, "
+            "eso TEXT, zip TEXT, county_name TEXT, county_fips TEXT, PRIMARY KEY (version, lon_key, lat_key))"
+        )
+        conn.execute("INSERT INTO geocode VALUES ('v1', -84100000, 33100000, 'ESO A', '30303', 'Fulton', '13121')")
+
+    cache = GeoCache("v1", path)
+    found, cached = cache.lookup(np.array([-84.1]), np.array([33.1]))
+    assert found[0] and cached["eso"][0] == "ESO A"
+    assert last_seen(path) == {(-84_100_000, 33_100_000): datetime.date.today().isoformat()}
@@ -0,0 +1,78 @@
+"""GridIndex lookups against the exact spatial-index test (spatial.polygon_positions without a grid)."""
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+
+from pipeline import grid as grid_index
+from pipeline import spatial
+
+
+@pytest.fixture(scope="module")
+def layer():
+    # Two squares sharing an edge, a triangle overlapped by a square, and a square with a hole
+    return gpd.GeoDataFrame(geometry=[
+        shapely.box(0, 0, 4, 4),
+        shapely.box(4, 0, 8, 4),
+        shapely.Polygon([(0, 5), (8, 5), (4, 9)]),
+        shapely.box(6, 6, 9, 9),
+        shapely.Polygon(shapely.box(10, 0, 14, 4).exterior.coords, [shapely.box(11, 1, 13, 3).exterior.coords]),
+    ], crs=spatial.CRS)
+
+
+def exact_positions(layer, x, y):
+    return spatial.polygon_positions(layer, xy=(x, y))
+
+
+def grid_positions(layer, grid, x, y):
+    return spatial.polygon_positions(layer, grid=grid, xy=(x, y))
+
+
+@pytest.mark.parametrize("base_cells, max_depth", [(grid_index.BASE_CELLS, grid_index.MAX_DEPTH), (4, 2), (7, 3)])
+def test_random_points_match_exact(layer, base_cells, max_depth):
+    grid = grid_index.GridIndex.build(layer.geometry.to_numpy(), base_cells, max_depth)
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(-1, 15, 20_000), rng.uniform(-1, 10, 20_000)
+    np.testing.assert_array_equal(grid_positions(layer, grid, x, y), exact_positions(layer, x, y))
+
+
+@pytest.mark.parametrize("base_cells, max_depth", [(grid_index.BASE_CELLS, grid_index.MAX_DEPTH), (4, 2), (7, 3)])
+def test_cell_boundaries_match_exact(layer, base_cells, max_depth):
+    # Cell corners, where rounding decides which cell a point lands in: every coarse corner and a sample of the finest ones
+    grid = grid_index.GridIndex.build(layer.geometry.to_numpy(), base_cells, max_depth)
+    minx, miny, maxx, maxy = grid.bounds
+    ny, nx = grid.shape
+    coarse_x, coarse_y = (a.ravel() for a in np.meshgrid(np.arange(nx + 1) * 2**max_depth, np.arange(ny + 1) * 2**max_depth))
+    rng = np.random.default_rng(0)
+    fine_x, fine_y = rng.integers(0, nx * 2**max_depth + 1, 50_000), rng.integers(0, ny * 2**max_depth + 1, 50_000)
+    step = grid.cell / 2**max_depth
+    x = minx + step * np.concatenate([coarse_x, fine_x])
+    y = miny + step * np.concatenate([coarse_y, fine_y])
+    np.testing.assert_array_equal(grid_positions(layer, grid, x, y), exact_positions(layer, x, y))
+
+
+def test_polygon_edges_and_vertices_match_exact(layer):
+    grid = grid_index.GridIndex.build(layer.geometry.to_numpy())
+    coords = shapely.get_coordinates(shapely.segmentize(layer.geometry.to_numpy(), 0.25))
+    # Points on the edges themselves and just either side of them
+    x = np.concatenate([coords[:, 0], coords[:, 0] + 1e-9, coords[:, 0] - 1e-9])
+    y = np.concatenate([coords[:, 1], coords[:, 1] + 1e-9, coords[:, 1] - 1e-9])
+    np.testing.assert_array_equal(grid_positions(layer, grid, x, y), exact_positions(layer, x, y))
+
+
+def test_shared_edge_overlap_and_hole(layer):
+    grid = grid_index.GridIndex.build(layer.geometry.to_numpy())
+    # On the shared edge (in neither), inside the overlap (first polygon wins), in the hole, well inside and far outside
+    x = np.array([4.0, 6.5, 12.0, 2.0, 20.0])
+    y = np.array([2.0, 6.0, 2.0, 2.0, 20.0])
+    np.testing.assert_array_equal(grid_positions(layer, grid, x, y), [-1, 2, -1, 0, -1])
+
+
+def test_lookup_resolves_interior_without_exact_test(layer):
+    grid = grid_index.GridIndex.build(layer.geometry.to_numpy())
+    found = grid.lookup(np.array([2.0, 2.0, np.nan, -5.0]), np.array([2.0, np.nan, 2.0, -5.0]))
+    np.testing.assert_array_equal(found, [0, grid_index.OUTSIDE, grid_index.OUTSIDE, grid_index.OUTSIDE])
+    rng = np.random.default_rng(1)
+    found = grid.lookup(rng.uniform(0, 14, 10_000), rng.uniform(0, 9, 10_000))
+    assert (found == grid_index.BOUNDARY).mean() < 0.1
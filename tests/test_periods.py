@@ -0,0 +1,118 @@
+"""PeriodStore keying by period and export, migration of older stores, and the combine rules."""
+
+import datetime
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from pipeline import periods, reports
+from pipeline.periods import Export, PeriodStore
+
+JAN = (datetime.date(2025, 1, 1), datetime.date(2025, 1, 31))
+FEB = (datetime.date(2025, 2, 1), datetime.date(2025, 2, 28))
+Q1 = (datetime.date(2025, 1, 1), datetime.date(2025, 3, 31))
+
+NETWORK_A = Export("aaaa", "TripsA.xlsx")
+NETWORK_B = Export("bbbb", "TripsB.xlsx")
+
+
+def partials(trips):
+    """One user's partials with `trips` trips (and as many logs)."""
+    individual = pd.DataFrame({
+        'User ID': ["u1"], 'Method': ["Carpool"], 'ESO': ["ESO A"], 'ESO Adjust State/Fed': ["ESO A"], 'Home ZIP': ["30303"],
+        **{metric: [float(trips)] for metric in reports.METRICS}, 'Logs': [trips],
+    })
+    territory_logs = pd.DataFrame({'Territory': ["ESO A"], 'Method': ["Carpool"], 'Logs': [trips]})
+    new_users = pd.DataFrame({'Territory': ["ESO A"], 'New Users': [1]})
+    return periods.PeriodPartials(individual, territory_logs, new_users)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PeriodStore(str(tmp_path / periods.DB_FILE))
+
+
+def stored(store, start, end, source):
+    return next(p for p in store.periods() if (p.start, p.end, p.source) == (start, end, source))
+
+
+def test_exports_for_the_same_period_are_kept_apart(store):
+    store.save(*JAN, partials(2), NETWORK_A)
+    store.save(*JAN, partials(3), NETWORK_B)
+    assert [(p.source, p.label) for p in store.periods()] == [("aaaa", "TripsA.xlsx"), ("bbbb", "TripsB.xlsx")]
+    assert store.load(stored(store, *JAN, "aaaa")).individual['Trips'].tolist() == [2.0]
+    assert store.load(stored(store, *JAN, "bbbb")).individual['Trips'].tolist() == [3.0]
+
+
+def test_saving_an_export_again_replaces_it(store):
+    store.save(*JAN, partials(2), NETWORK_A)
+    store.save(*JAN, partials(5), NETWORK_A)
+    assert len(store.periods()) == 1
+    loaded = store.load(store.periods()[0])
+    assert loaded.individual['Trips'].tolist() == [5.0] and loaded.territory_logs['Logs'].tolist() == [5]
+
+
+def test_combine_sums_periods_and_exports(store):
+    store.save(*JAN, partials(2), NETWORK_A)
+    store.save(*JAN, partials(3), NETWORK_B)
+    store.save(*FEB, partials(4), Export("cccc", "TripsFeb.xlsx"))
+    combined = store.combine(store.periods())
+    assert combined.individual['Trips'].tolist() == [9.0]
+    assert combined.territory_logs['Logs'].tolist() == [9]
+    assert combined.new_users['New Users'].tolist() == [3]
+
+
+def test_combine_refuses_overlapping_periods(store):
+    store.save(*JAN, partials(2), NETWORK_A)
+    store.save(*Q1, partials(3), NETWORK_B)
+    with pytest.raises(ValueError, match="overlap"):
+        store.combine(store.periods())
+
+
+def test_combine_refuses_one_export_under_two_periods(store):
+    store.save(*JAN, partials(2), NETWORK_A)
+    store.save(*FEB, partials(2), NETWORK_A)
+    with pytest.raises(ValueError, match="counted twice"):
+        store.combine(store.periods())
+
+
+@pytest.mark.parametrize("chosen", [
+    [JAN, FEB],
+    [JAN, JAN],
+    [FEB, JAN],
+    [(datetime.date(2025, 1, 1), datetime.date(2025, 1, 15)), (datetime.date(2025, 1, 16), datetime.date(2025, 1, 31))],
+])
+def test_check_disjoint_accepts(chosen):
+    periods.check_disjoint(chosen)
+
+
+@pytest.mark.parametrize("chosen", [
+    [JAN, Q1],
+    [Q1, FEB],
+    [(datetime.date(2025, 1, 1), datetime.date(2025, 1, 15)), (datetime.date(2025, 1, 15), datetime.date(2025, 1, 31))],
+])
+def test_check_disjoint_rejects(chosen):
+    with pytest.raises(ValueError):
+        periods.check_disjoint(chosen)
+
+
+def test_store_from_before_exports_is_migrated(tmp_path):
+    # The layout written before partials were keyed by export: periods keyed by (start, end), no source column anywhere
+    path = str(tmp_path / periods.DB_FILE)
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE periods (start TEXT, end TEXT, saved TEXT, PRIMARY KEY (start, end))")
+        conn.execute("INSERT INTO periods VALUES ('2025-01-01', '2025-01-31', '2025-02-01T09:00:00')")
+        for name, table in partials(2)._asdict().items():
+            table.assign(period_start="2025-01-01", period_end="2025-01-31").to_sql(name, conn, index=False)
+
+    store = PeriodStore(path)
+    [legacy] = store.periods()
+    assert legacy == periods.StoredPeriod(*JAN, "", "", "2025-02-01T09:00:00")
+    assert store.load(legacy).individual['Trips'].tolist() == [2.0]
+
+    # New exports for the same period are stored alongside the migrated one, which still loads
+    store.save(*JAN, partials(3), NETWORK_A)
+    assert [p.source for p in store.periods()] == ["", "aaaa"]
+    assert store.load(legacy).individual['Trips'].tolist() == [2.0]
+    assert PeriodStore(path).periods() == store.periods()